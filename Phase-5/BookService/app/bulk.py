@@ -0,0 +1,169 @@
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_engine
+from app.models.book import Book
+from app.schemas.book import BookCreate
+from app.search import search_backend
+from app.events import publish, CREATED
+from app.stats import bump
+from dotenv import load_dotenv
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+import csv
+import io
+import orjson
+import os
+import time
+
+load_dotenv()
+# Rows validated, inserted and committed together
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Per-row errors listed in the report; the counts always cover every row
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+# CSV uploads are spooled to disk past this many bytes
+BULK_SPOOL_BYTES = int(os.getenv("BULK_SPOOL_BYTES", str(8 * 1024 * 1024)))
+
+BULK_FIELDS = ("title", "author", "isbn", "copies")
+RETURNED_COLUMNS = (Book.id, Book.title, Book.author, Book.isbn, Book.copies)
+
+STAGING_TABLE = (
+    "CREATE TEMP TABLE IF NOT EXISTS books_staging "
+    "(title text, author text, isbn text, copies integer) ON COMMIT DELETE ROWS"
+)
+MERGE_STAGING = (
+    "INSERT INTO books (title, author, isbn, copies, available_copies) "
+    "SELECT title, author, isbn, copies, copies FROM books_staging "
+    "ON CONFLICT (isbn) DO NOTHING RETURNING id, title, author, isbn, copies"
+)
+
+
+class BulkReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row: int, isbn, error: str):
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "isbn": isbn, "error": error})
+
+    def as_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.received / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+async def _json_rows(request: Request):
+    try:
+        items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of books")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of books")
+    return enumerate(items, 1)
+
+
+async def _csv_rows(request: Request):
+    # Spool the upload so memory stays bounded and quoted multi-line fields parse correctly
+    spool = SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    reader = csv.DictReader(io.TextIOWrapper(spool, encoding="utf-8-sig", newline=""))
+    missing = [field for field in BULK_FIELDS if field not in (reader.fieldnames or [])]
+    if missing:
+        spool.close()
+        raise HTTPException(status_code=400, detail=f"CSV header is missing: {', '.join(missing)}")
+    return enumerate(reader, 1)
+
+
+def _validate(chunk, seen_isbns: set, report: BulkReport) -> list:
+    books = []
+    for row, item in chunk:
+        report.received += 1
+        if not isinstance(item, dict):
+            report.add_error(row, None, "Row must be an object")
+            continue
+        isbn = item.get("isbn")
+        try:
+            book = BookCreate(**item)
+        except ValidationError as e:
+            report.add_error(row, isbn, "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()
+            ))
+            continue
+        if book.isbn in seen_isbns:
+            report.add_error(row, book.isbn, "Duplicate ISBN in upload")
+            continue
+        seen_isbns.add(book.isbn)
+        books.append((row, book))
+    return books
+
+
+async def _copy_insert(db: AsyncSession, books: list) -> list:
+    conn = await db.connection()
+    await conn.execute(text(STAGING_TABLE))
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        "books_staging", records=[tuple(getattr(book, field) for field in BULK_FIELDS) for _, book in books],
+        columns=list(BULK_FIELDS)
+    )
+    return (await conn.execute(text(MERGE_STAGING))).all()
+
+
+async def _executemany_insert(db: AsyncSession, books: list) -> list:
+    insert = postgresql_insert if async_engine.dialect.name == "postgresql" else sqlite_insert
+    statement = insert(Book).on_conflict_do_nothing(index_elements=["isbn"]).returning(*RETURNED_COLUMNS)
+    params = [dict(book.dict(), available_copies=book.copies) for _, book in books]
+    return (await db.execute(statement, params)).all()
+
+
+def _use_copy() -> bool:
+    return async_engine.dialect.name == "postgresql" and async_engine.dialect.driver == "asyncpg"
+
+
+async def bulk_import(request: Request, db: AsyncSession) -> dict:
+    """Insert a JSON array or CSV upload of books chunk by chunk.
+
+    Each chunk is validated, inserted with ON CONFLICT (isbn) DO NOTHING and
+    committed with its counter bumps, so a failure late in a large upload
+    keeps the chunks before it. Rows that fail validation or hit an existing
+    ISBN are reported by their 1-based position in the upload.
+    """
+    if "csv" in request.headers.get("content-type", ""):
+        rows = await _csv_rows(request)
+    else:
+        rows = await _json_rows(request)
+    insert = _copy_insert if _use_copy() else _executemany_insert
+    report = BulkReport()
+    seen_isbns = set()
+    while chunk := list(islice(rows, BULK_CHUNK_SIZE)):
+        books = _validate(chunk, seen_isbns, report)
+        if not books:
+            continue
+        inserted = await insert(db, books)
+        copies = sum(row.copies for row in inserted)
+        await bump(db, books=len(inserted), total_copies=copies, available_copies=copies)
+        await publish(db, CREATED, [dict(row._mapping, available_copies=row.copies) for row in inserted])
+        await db.commit()
+        report.inserted += len(inserted)
+        search_backend.add_many(inserted)
+        inserted_isbns = {row.isbn for row in inserted}
+        for row, book in books:
+            if book.isbn not in inserted_isbns:
+                report.add_error(row, book.isbn, "ISBN already exists")
+    return report.as_dict()
@@ -0,0 +1,9 @@
+from sqlalchemy import func, select
+from app.models.book import Book
+
+# Each counter and the full-scan query that rebuilds it
+COUNTERS = {
+    "books": select(func.count(Book.id)),
+    "total_copies": select(func.sum(Book.copies)),
+    "available_copies": select(func.sum(Book.available_copies)),
+}
@@ -1,15 +1,157 @@
+# Shared module: LoanService/app/database.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
+import logging
 import os
+import time
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 print(f"DATABASE_URL: {DATABASE_URL}")
 
-engine = create_engine(DATABASE_URL)
+# Pool settings, applied to the sync and the async engine alike
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds before a pooled connection is replaced; -1 keeps connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# PostgreSQL statement_timeout in milliseconds; 0 leaves the server default
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Checkouts that wait longer than this are logged
+DB_POOL_SLOW_WAIT_MS = float(os.getenv("DB_POOL_SLOW_WAIT_MS", "100"))
+
+logger = logging.getLogger(__name__)
+
+# Async drivers for the request path: asyncpg for PostgreSQL, aiosqlite for local runs
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+
+class PoolMetrics:
+    """Checkout wait times for one engine's pool, read alongside its live gauges."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+
+    def record(self, pool, waited: float, timed_out: bool = False):
+        if timed_out:
+            self.timeouts += 1
+            logger.warning("%s pool exhausted: gave up after waiting %.1f ms (%s)",
+                           self.name, waited * 1000, pool.status())
+            return
+        self.checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        if waited * 1000 >= DB_POOL_SLOW_WAIT_MS:
+            self.slow_checkouts += 1
+            logger.warning("%s pool under pressure: checkout waited %.1f ms (%s)",
+                           self.name, waited * 1000, pool.status())
+
+    def stats(self, pool) -> dict:
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checkouts": self.checkouts,
+            "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "slow_checkouts": self.slow_checkouts,
+            "timeouts": self.timeouts,
+        }
+
+
+class TimedPoolMixin:
+    metrics: PoolMetrics | None = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.metrics:
+                self.metrics.record(self, time.perf_counter() - started, timed_out=True)
+            raise
+        if self.metrics:
+            self.metrics.record(self, time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, is_async: bool) -> dict:
+    parsed = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in a single connection; keep SQLAlchemy's default pool
+        return options
+    options.update(
+        poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if DB_STATEMENT_TIMEOUT_MS > 0 and parsed.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+# The sync engine is kept for create_all and offline scripts
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL, is_async=False))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+POOL_METRICS = {"sync": PoolMetrics("sync"), "async": PoolMetrics("async")}
+engine.pool.metrics = POOL_METRICS["sync"]
+async_engine.sync_engine.pool.metrics = POOL_METRICS["async"]
+
+def pool_stats() -> dict:
+    pools = {"sync": engine.pool, "async": async_engine.sync_engine.pool}
+    return {
+        name: POOL_METRICS[name].stats(pool) if isinstance(pool, TimedPoolMixin) else {"status": pool.status()}
+        for name, pool in pools.items()
+    }
+
 Base = declarative_base()
 
 def get_db():
@@ -17,4 +159,8 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,85 @@
+from collections.abc import Mapping
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal
+from app.models.book_event import BookEvent
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import time
+
+load_dotenv()
+# Events older than this are pruned; consumers further behind re-bootstrap from the catalog
+BOOK_EVENT_RETENTION_SECONDS = float(os.getenv("BOOK_EVENT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Seconds between prunes; 0 disables the schedule
+BOOK_EVENT_PRUNE_INTERVAL = float(os.getenv("BOOK_EVENT_PRUNE_INTERVAL", "3600"))
+MAX_EVENT_PAGE = 1000
+
+CREATED, UPDATED, AVAILABILITY, DELETED = "created", "updated", "availability", "deleted"
+EVENT_FIELDS = ("id", "title", "author", "isbn", "copies", "available_copies")
+
+logger = logging.getLogger(__name__)
+
+def book_state(book) -> dict:
+    if isinstance(book, Mapping):
+        return {field: book[field] for field in EVENT_FIELDS}
+    return {field: getattr(book, field) for field in EVENT_FIELDS}
+
+async def publish(db: AsyncSession, type: str, books):
+    """Append one event per book inside the caller's transaction; commit with the change."""
+    now = time.time()
+    rows = [
+        {"book_id": book["id"], "type": type, "book": None if type == DELETED else book, "published_at": now}
+        for book in map(book_state, books)
+    ]
+    if rows:
+        await db.execute(insert(BookEvent), rows)
+
+async def read_events(db: AsyncSession, after: int, limit: int) -> dict:
+    """Events after `after` up to the first hole in the offsets.
+
+    PostgreSQL hands out ids at insert time, so a hole is either a transaction
+    that has not committed yet or one that rolled back; only the consumer can
+    decide how long to wait before treating it as the latter. The hole is
+    reported as `gap` ([first, last] missing offset) and never skipped here.
+    """
+    rows = (await db.execute(
+        select(BookEvent).filter(BookEvent.id > after).order_by(BookEvent.id).limit(limit)
+    )).scalars().all()
+    first, head = (await db.execute(select(func.min(BookEvent.id), func.max(BookEvent.id)))).one()
+    events = []
+    gap = None
+    expected = after + 1
+    for row in rows:
+        if row.id != expected:
+            gap = [expected, row.id - 1]
+            break
+        events.append({"offset": row.id, "type": row.type, "book_id": row.book_id, "book": row.book,
+                       "published_at": row.published_at})
+        expected = row.id + 1
+    return {
+        "events": events,
+        "next_offset": events[-1]["offset"] if events else after,
+        "gap": gap,
+        "first_offset": first or 0,
+        "head_offset": head or 0,
+    }
+
+async def prune_events(db: AsyncSession) -> int:
+    result = await db.execute(
+        delete(BookEvent).where(BookEvent.published_at < time.time() - BOOK_EVENT_RETENTION_SECONDS)
+    )
+    await db.commit()
+    return result.rowcount
+
+async def prune_events_periodically():
+    while True:
+        await asyncio.sleep(BOOK_EVENT_PRUNE_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                pruned = await prune_events(db)
+            if pruned:
+                logger.info("Pruned %d book events", pruned)
+        except Exception:
+            logger.exception("Book event prune failed")
@@ -1,11 +1,48 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routes import books
-from app.database import Base, engine
+from app.database import Base, engine, pool_stats
+from app.migrations import run_migrations
+from app.search import search_backend
+from app.metrics import MetricsMiddleware, instrument_engines, metrics_response
+from app.tracing import TracingMiddleware, close_exporter, trace_engines
+from app.stats import ensure_counters, reconcile_periodically, STATS_RECONCILE_INTERVAL
+from app.events import prune_events_periodically, BOOK_EVENT_PRUNE_INTERVAL
+import asyncio
 
-Base.metadata.create_all(bind=engine)
+run_migrations(engine, Base.metadata)
+instrument_engines()
+trace_engines()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await search_backend.start()
+    await ensure_counters()
+    reconciler = asyncio.create_task(reconcile_periodically()) if STATS_RECONCILE_INTERVAL > 0 else None
+    pruner = asyncio.create_task(prune_events_periodically()) if BOOK_EVENT_PRUNE_INTERVAL > 0 else None
+    yield
+    if reconciler:
+        reconciler.cancel()
+    if pruner:
+        pruner.cancel()
+    await search_backend.stop()
+    close_exporter()
 
 app = FastAPI(
     title="Book Service",
-    root_path="/api/books"
+    root_path="/api/books",
+    lifespan=lifespan
     )
-app.include_router(books.router)
\ No newline at end of file
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="book-service")
+
+# Registered before the router so "/{id}" does not shadow them
+@app.get("/metrics")
+def get_metrics():
+    return metrics_response()
+
+@app.get("/db-pool-stats")
+def get_db_pool_stats():
+    return pool_stats()
+
+app.include_router(books.router)
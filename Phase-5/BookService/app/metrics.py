@@ -0,0 +1,220 @@
+# Shared module: LoanService/app/metrics.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from fastapi.responses import Response
+from sqlalchemy import event
+from app.database import engine, async_engine, pool_stats
+from bisect import bisect_left
+from contextvars import ContextVar
+import time
+
+# In-process metrics in the Prometheus text format. Each worker process keeps its
+# own registry, so scrape every worker (or run one per container).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        # Optional callable returning {label values: value}, read at scrape time
+        self.collect = collect
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.collect:
+            self.values = self.collect()
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            # Per-bucket counts (made cumulative when rendered), sum, count
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {count}"
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def _pool_stat(field: str):
+    return lambda: {(name,): stats.get(field, 0) for name, stats in pool_stats().items()}
+
+
+http_requests = register(Counter(
+    "http_requests_total", "HTTP requests served", ("method", "route", "status")))
+http_latency = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency, including the response body", ("method", "route")))
+http_in_flight = register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"))
+request_db_queries = register(Histogram(
+    "http_request_db_queries", "Database queries issued per HTTP request", ("route",), COUNT_BUCKETS))
+request_db_time = register(Histogram(
+    "http_request_db_seconds", "Time spent in database queries per HTTP request", ("route",)))
+request_downstream_time = register(Histogram(
+    "http_request_downstream_seconds", "Time spent in downstream service calls per HTTP request (summed)", ("route",)))
+db_query_latency = register(Histogram(
+    "db_query_duration_seconds", "Latency of individual database queries", ("engine",)))
+downstream_latency = register(Histogram(
+    "downstream_request_duration_seconds", "Latency of calls to other services", ("service", "method", "status")))
+db_pool_checked_out = register(Gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool", ("engine",), _pool_stat("checked_out")))
+db_pool_overflow = register(Gauge(
+    "db_pool_overflow", "Overflow connections currently open", ("engine",), _pool_stat("overflow")))
+db_pool_timeouts = register(Counter(
+    "db_pool_timeouts_total", "Pool checkouts that timed out", ("engine",), _pool_stat("timeouts")))
+
+
+class RequestTimings:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.downstream_time = 0.0
+
+
+# Set by the middleware for the duration of each request
+current_request: ContextVar[RequestTimings | None] = ContextVar("current_request", default=None)
+
+
+def observe_downstream(service: str, method: str, status, elapsed: float):
+    downstream_latency.observe(elapsed, service, method, status)
+    timings = current_request.get()
+    if timings is not None:
+        timings.downstream_time += elapsed
+
+
+def instrument_engine(sync_engine, name: str):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def finish_query(conn):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_latency.observe(elapsed, name)
+        timings = current_request.get()
+        if timings is not None:
+            timings.db_queries += 1
+            timings.db_time += elapsed
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        finish_query(conn)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute; pop its start here so the
+        # pooled connection's stack stays matched
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            finish_query(conn)
+
+
+def instrument_engines():
+    instrument_engine(engine, "sync")
+    instrument_engine(async_engine.sync_engine, "async")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed bodies are timed to their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+        timings = RequestTimings()
+        token = current_request.set(timings)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec()
+            current_request.reset(token)
+            # Label by route template, not raw path, to keep the series count bounded
+            route = scope.get("route")
+            route = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            http_requests.inc(method, route, status[0])
+            http_latency.observe(time.perf_counter() - started, method, route)
+            request_db_queries.observe(timings.db_queries, route)
+            request_db_time.observe(timings.db_time, route)
+            request_downstream_time.observe(timings.downstream_time, route)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def metrics_response() -> Response:
+    return Response(render(), media_type="text/plain; version=0.0.4")
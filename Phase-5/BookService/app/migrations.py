@@ -0,0 +1,41 @@
+# Shared module: LoanService/app/migrations.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Engine
+from app.schema_changes import MIGRATIONS
+
+# Arbitrary key for the PostgreSQL advisory lock that serializes runners
+MIGRATION_LOCK_KEY = 5_318_008
+
+def _lock(conn):
+    """Hold the database's migration lock until the transaction ends, so workers
+    starting together apply each migration once and never concurrently."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    elif conn.dialect.name == "sqlite":
+        # pysqlite would only open the transaction at the first write; take the write lock now
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def run_migrations(engine: Engine, metadata: MetaData | None = None):
+    """Create metadata's missing tables, then apply pending MIGRATIONS.
+
+    Both happen in one transaction under the lock, so a worker that waited sees
+    the tables and versions the first one created.
+    """
+    with engine.begin() as conn:
+        _lock(conn)
+        if metadata is not None:
+            metadata.create_all(bind=conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(100) PRIMARY KEY, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+        for version, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": version})
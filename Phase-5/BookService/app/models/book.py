@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -12,4 +12,7 @@ class Book(Base):
     copies = Column(Integer)
     available_copies = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Serves keyset pagination ordered by (title, id)
+    __table_args__ = (Index("ix_books_title_id", "title", "id"),)
\ No newline at end of file
@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Float, JSON
+from app.database import Base
+
+# Change feed (outbox) row, written in the same transaction as the change it describes.
+# The id is the feed offset; AUTOINCREMENT keeps SQLite from reusing ids after pruning.
+class BookEvent(Base):
+    __tablename__ = "book_events"
+
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, nullable=False)
+    type = Column(String, nullable=False)
+    # Full book state after the change; null for deletes
+    book = Column(JSON, nullable=True)
+    # Epoch seconds, compared across services for replication lag
+    published_at = Column(Float, nullable=False)
+
+    __table_args__ = ({"sqlite_autoincrement": True},)
@@ -0,0 +1,20 @@
+# Shared module: LoanService/app/responses.py is the canonical copy and BookService
+# carries an identical one. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from fastapi.responses import Response
+import orjson
+
+class ORJSONResponse(Response):
+    """Encodes plain dicts/lists straight to JSON bytes.
+
+    Returning it from a route skips FastAPI's response_model validation and
+    encoding, so list endpoints can hand over column tuples without building
+    ORM objects or pydantic models first.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+def rows_to_dicts(rows, fields) -> list:
+    return [dict(zip(fields, row)) for row in rows]
@@ -1,91 +1,293 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, func, select, tuple_, update
+from typing import List, Optional
+from collections import Counter
+from app.database import get_async_db
 from app.models.book import Book
-from app.schemas.book import BookCreate, BookResponse, BookAvailabilityUpdate, BookSearchResponse
+from app.bulk import bulk_import
+from app.events import publish, read_events, CREATED, UPDATED, AVAILABILITY, DELETED, MAX_EVENT_PAGE
+from app.export import export_response
+from app.pagination import encode_cursor, decode_cursor
+from app.responses import ORJSONResponse, rows_to_dicts
+from app.search import search_backend
+from app.stats import bump, read_counters, reconcile
+from app.schemas.book import (BookCreate, BookResponse, BookAvailabilityUpdate, BookSearchResponse, BookBatchUpdate,
+                              BookBatchResult)
 
 router = APIRouter(tags=["Books"])
 
 @router.post("/", response_model=BookResponse, status_code=201)
-def create_book(book: BookCreate, db: Session = Depends(get_db)):
-    db_book = db.query(Book).filter(Book.isbn == book.isbn).first()
+async def create_book(book: BookCreate, db: AsyncSession = Depends(get_async_db)):
+    db_book = (await db.execute(select(Book).filter(Book.isbn == book.isbn))).scalars().first()
     if db_book:
         raise HTTPException(status_code=400, detail="ISBN already exists")
     new_book = Book(**book.dict(), available_copies=book.copies)
     db.add(new_book)
-    db.commit()
-    db.refresh(new_book)
+    await db.flush()
+    await publish(db, CREATED, [new_book])
+    await bump(db, books=1, total_copies=book.copies, available_copies=book.copies)
+    await db.commit()
+    await db.refresh(new_book)
+    search_backend.add(new_book)
     return new_book
 
+@router.post("/bulk")
+async def bulk_import_books(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await bulk_import(request, db)
+
+# Columns of BookResponse, selected as plain tuples by the list endpoints
+BOOK_COLUMNS = (Book.id, Book.title, Book.author, Book.isbn, Book.copies, Book.available_copies,
+                Book.created_at, Book.updated_at)
+BOOK_FIELDS = tuple(column.key for column in BOOK_COLUMNS)
+
+MAX_PER_PAGE = 1000
+
 @router.get("/", response_model=BookSearchResponse)
-def search_books(search: str = "", page: int = 1, per_page: int = 10, db: Session = Depends(get_db)):
-    query = db.query(Book).filter(
-        or_(
-            Book.title.ilike(f"%{search}%"),
-            Book.author.ilike(f"%{search}%"),
-            Book.isbn.ilike(f"%{search}%")
-        )
-    )
-    total = query.count()
-    books = query.offset((page - 1) * per_page).limit(per_page).all()
-    return {"books": books, "total": total, "page": page, "per_page": per_page}
+async def search_books(search: str = "", page: int = Query(1, ge=1), per_page: int = Query(10, ge=1, le=MAX_PER_PAGE),
+                       after: Optional[str] = None, include_total: bool = True, sort: str = "title",
+                       db: AsyncSession = Depends(get_async_db)):
+    if sort not in ("title", "relevance"):
+        raise HTTPException(status_code=400, detail="sort must be 'title' or 'relevance'")
+    cursor = None
+    if after:
+        title, book_id = decode_cursor(after, 2)
+        if not isinstance(title, str) or not isinstance(book_id, int) or isinstance(book_id, bool):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        cursor = (title, book_id)
+    if search and search_backend.in_process:
+        return await search_in_process(db, search, page, per_page, cursor, include_total, sort)
+    query = select(*BOOK_COLUMNS)
+    if search:
+        query = query.filter(search_backend.match(search))
+    total = None
+    if include_total:
+        total = (await db.execute(select(func.count()).select_from(query.subquery()))).scalar()
+    if sort == "relevance" and search:
+        # Ranked results are paged by offset only; cursors follow the (title, id) order
+        query = query.order_by(search_backend.rank(search).desc(), Book.id).offset((page - 1) * per_page)
+        rows = (await db.execute(query.limit(per_page))).all()
+        return ORJSONResponse({"books": rows_to_dicts(rows, BOOK_FIELDS), "total": total, "page": page,
+                               "per_page": per_page, "next_cursor": None})
+    query = query.order_by(Book.title, Book.id)
+    if cursor:
+        # Keyset mode: seek past the last (title, id) seen, so deep pages cost the same as the first
+        query = query.filter(tuple_(Book.title, Book.id) > tuple_(*cursor))
+    else:
+        query = query.offset((page - 1) * per_page)
+    rows = (await db.execute(query.limit(per_page + 1))).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].title, rows[-1].id)
+    return ORJSONResponse({"books": rows_to_dicts(rows, BOOK_FIELDS), "total": total, "page": page,
+                           "per_page": per_page, "next_cursor": next_cursor})
+
+async def search_in_process(db: AsyncSession, search: str, page: int, per_page: int, cursor, include_total: bool,
+                            sort: str):
+    """Search served by the in-process index: it counts and pages the matches, and
+    only the page's ids go to SQL (a whole match set can exceed SQLite's bound
+    parameter limit)."""
+    offset = (page - 1) * per_page
+    next_cursor = None
+    if sort == "relevance":
+        page_ids = search_backend.ranked_page(search, offset, per_page)
+    else:
+        page_ids = search_backend.title_page(search, offset, per_page + 1, cursor)
+    rows = (await db.execute(select(*BOOK_COLUMNS).filter(Book.id.in_(page_ids)))).all() if page_ids else []
+    # Put the rows back in the index's order
+    position = {book_id: i for i, book_id in enumerate(page_ids)}
+    rows.sort(key=lambda row: position[row.id])
+    if sort != "relevance" and len(page_ids) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].title, rows[-1].id) if rows else None
+    total = search_backend.count(search) if include_total else None
+    return ORJSONResponse({"books": rows_to_dicts(rows, BOOK_FIELDS), "total": total, "page": page,
+                           "per_page": per_page, "next_cursor": next_cursor})
 
 #stats
 
 @router.get("/stats", tags=["Books"])
-def get_book_stats(db: Session = Depends(get_db)):
-    total_books = db.query(Book).count()
-    total_copies = db.query(func.sum(Book.copies)).scalar() or 0
-    available_copies = db.query(func.sum(Book.available_copies)).scalar() or 0
-    return {"books": total_books, "total_copies": total_copies, "available_copies": available_copies}
+async def get_book_stats(db: AsyncSession = Depends(get_async_db)):
+    counters = await read_counters(db)
+    return {"books": counters.get("books", 0), "total_copies": counters.get("total_copies", 0),
+            "available_copies": counters.get("available_copies", 0)}
+
+@router.post("/stats/reconcile", tags=["Books"])
+async def reconcile_book_stats(db: AsyncSession = Depends(get_async_db)):
+    return await reconcile(db)
+
+MAX_BATCH_IDS = 500
+
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
+
+@router.get("/batch", response_model=List[BookResponse])
+async def get_books_batch(ids: str, db: AsyncSession = Depends(get_async_db)):
+    book_ids = parse_ids(ids)
+    if not book_ids:
+        return []
+    return (await db.execute(select(Book).filter(Book.id.in_(book_ids)))).scalars().all()
+
+async def adjust_copies_batch(db: AsyncSession, book_ids: List[int], direction: int, unavailable: str) -> dict:
+    """Reserve (direction -1) or release (+1) copies of many books in one conditional UPDATE.
+
+    A book listed n times moves n copies; each book succeeds or fails as a whole.
+    """
+    counts = Counter(book_ids)
+    if len(counts) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    if not counts:
+        return {"books": [], "failed": []}
+    quantity = case(counts, value=Book.id)
+    if direction < 0:
+        condition = Book.available_copies >= quantity
+    else:
+        condition = Book.available_copies + quantity <= Book.copies
+    books = (await db.execute(
+        update(Book)
+        .where(Book.id.in_(list(counts)), condition)
+        .values(available_copies=Book.available_copies + direction * quantity)
+        .returning(*Book.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )).mappings().all()
+    updated = {book["id"] for book in books}
+    missing = [book_id for book_id in counts if book_id not in updated]
+    existing = set()
+    if missing:
+        existing = set((await db.execute(select(Book.id).filter(Book.id.in_(missing)))).scalars())
+    await bump(db, available_copies=direction * sum(counts[book_id] for book_id in updated))
+    await publish(db, AVAILABILITY, books)
+    await db.commit()
+    failed = [
+        {"book_id": book_id, "status_code": 400, "detail": unavailable} if book_id in existing
+        else {"book_id": book_id, "status_code": 404, "detail": "Book not found"}
+        for book_id in missing
+    ]
+    return {"books": [dict(book) for book in books], "failed": failed}
+
+# Registered before "/{id}/reserve" so "batch" is not parsed as an id
+
+@router.post("/batch/reserve", response_model=BookBatchResult)
+async def reserve_books(batch: BookBatchUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await adjust_copies_batch(db, batch.book_ids, -1, "No available copies")
+
+@router.post("/batch/release", response_model=BookBatchResult)
+async def release_books(batch: BookBatchUpdate, db: AsyncSession = Depends(get_async_db)):
+    return await adjust_copies_batch(db, batch.book_ids, 1, "All copies already available")
+
+@router.get("/export")
+async def export_books(format: str = "ndjson"):
+    return export_response(select(*BOOK_COLUMNS).order_by(Book.id), BOOK_FIELDS, format, "books")
+
+@router.get("/events")
+async def get_book_events(after: int = Query(0, ge=0), limit: int = 500, db: AsyncSession = Depends(get_async_db)):
+    """Change feed: events with offset > after, oldest first. Poll again from next_offset;
+    when `gap` is set, the offsets in it are not visible (yet) and the page stops before them."""
+    if not 0 <= limit <= MAX_EVENT_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 0 and {MAX_EVENT_PAGE}")
+    return ORJSONResponse(await read_events(db, after, limit))
 
 @router.get("/{id}", response_model=BookResponse)
-def get_book(id: int, db: Session = Depends(get_db)):
-    book = db.query(Book).filter(Book.id == id).first()
+async def get_book(id: int, db: AsyncSession = Depends(get_async_db)):
+    book = await db.get(Book, id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
     return book
 
 @router.put("/{id}", response_model=BookResponse)
-def update_book(id: int, book_update: BookCreate, db: Session = Depends(get_db)):
-    db_book = db.query(Book).filter(Book.id == id).first()
+async def update_book(id: int, book_update: BookCreate, db: AsyncSession = Depends(get_async_db)):
+    db_book = await db.get(Book, id)
     if not db_book:
         raise HTTPException(status_code=404, detail="Book not found")
+    old_copies, old_available = db_book.copies, db_book.available_copies
     for key, value in book_update.dict().items():
         setattr(db_book, key, value)
     db_book.available_copies = db_book.copies  # Reset available copies
-    db.commit()
-    db.refresh(db_book)
+    await bump(db, total_copies=db_book.copies - old_copies, available_copies=db_book.available_copies - old_available)
+    await publish(db, UPDATED, [db_book])
+    await db.commit()
+    await db.refresh(db_book)
+    search_backend.add(db_book)
     return db_book
 
 @router.patch("/{id}/availability", response_model=BookResponse)
-def update_availability(id: int, update: BookAvailabilityUpdate, db: Session = Depends(get_db)):
-    book = db.query(Book).filter(Book.id == id).first()
+async def update_availability(id: int, update: BookAvailabilityUpdate, db: AsyncSession = Depends(get_async_db)):
+    book = await db.get(Book, id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+    old_available = book.available_copies
     if update.operation == "increment":
         book.available_copies = update.available_copies
     elif update.operation == "decrement":
         book.available_copies = update.available_copies
     else:
         raise HTTPException(status_code=400, detail="Invalid operation")
-    db.commit()
-    db.refresh(book)
+    await bump(db, available_copies=book.available_copies - old_available)
+    await publish(db, AVAILABILITY, [book])
+    await db.commit()
+    await db.refresh(book)
     return book
 
+# Atomic inventory changes: the availability check and the write are one conditional UPDATE
+
+@router.post("/{id}/reserve", response_model=BookResponse)
+async def reserve_book(id: int, db: AsyncSession = Depends(get_async_db)):
+    book = (await db.execute(
+        update(Book)
+        .where(Book.id == id, Book.available_copies > 0)
+        .values(available_copies=Book.available_copies - 1)
+        .returning(*Book.__table__.columns)
+    )).mappings().first()
+    if book is None:
+        await db.rollback()
+        if await db.get(Book, id) is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=400, detail="No available copies")
+    await bump(db, available_copies=-1)
+    await publish(db, AVAILABILITY, [book])
+    await db.commit()
+    return dict(book)
+
+@router.post("/{id}/release", response_model=BookResponse)
+async def release_book(id: int, db: AsyncSession = Depends(get_async_db)):
+    book = (await db.execute(
+        update(Book)
+        .where(Book.id == id, Book.available_copies < Book.copies)
+        .values(available_copies=Book.available_copies + 1)
+        .returning(*Book.__table__.columns)
+    )).mappings().first()
+    if book is None:
+        await db.rollback()
+        if await db.get(Book, id) is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=400, detail="All copies already available")
+    await bump(db, available_copies=1)
+    await publish(db, AVAILABILITY, [book])
+    await db.commit()
+    return dict(book)
+
 @router.delete("/{id}", status_code=204)
-def delete_book(id: int, db: Session = Depends(get_db)):
-    book = db.query(Book).filter(Book.id == id).first()
+async def delete_book(id: int, db: AsyncSession = Depends(get_async_db)):
+    book = await db.get(Book, id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
-    db.delete(book)
-    db.commit()
+    await publish(db, DELETED, [book])
+    await db.delete(book)
+    await bump(db, books=-1, total_copies=-book.copies, available_copies=-book.available_copies)
+    await db.commit()
+    search_backend.remove(id)
     return
 
 @router.get("/{id}/availability")
-def check_book_availability(id: int, db: Session = Depends(get_db)):
-    book = db.query(Book).filter(Book.id == id).first()
+async def check_book_availability(id: int, db: AsyncSession = Depends(get_async_db)):
+    book = await db.get(Book, id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
     if book.available_copies < 1:
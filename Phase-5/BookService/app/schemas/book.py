@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 class BookCreate(BaseModel):
     title: str
@@ -27,6 +27,19 @@ class BookAvailabilityUpdate(BaseModel):
 
 class BookSearchResponse(BaseModel):
     books: List[BookResponse]
-    total: int
+    total: Optional[int] = None
     page: int
-    per_page: int
\ No newline at end of file
+    per_page: int
+    next_cursor: Optional[str] = None
+
+class BookBatchUpdate(BaseModel):
+    book_ids: List[int]
+
+class BookBatchFailure(BaseModel):
+    book_id: int
+    status_code: int
+    detail: str
+
+class BookBatchResult(BaseModel):
+    books: List[BookResponse]
+    failed: List[BookBatchFailure]
\ No newline at end of file
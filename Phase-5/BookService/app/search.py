@@ -0,0 +1,290 @@
+from sqlalchemy import func, literal_column, or_, select, text
+from app.database import async_engine, AsyncSessionLocal
+from app.events import read_events, AVAILABILITY, DELETED, MAX_EVENT_PAGE
+from app.models.book import Book
+from app.models.book_event import BookEvent
+from dotenv import load_dotenv
+from bisect import bisect_left, insort
+import asyncio
+import heapq
+import logging
+import os
+import re
+import time
+
+load_dotenv()
+# "postgres", "memory" or "auto" (postgres when the database is PostgreSQL)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+# Seconds between polls of the book_events feed that keep each worker's in-memory index current
+SEARCH_SYNC_INTERVAL = float(os.getenv("SEARCH_SYNC_INTERVAL", "0.5"))
+# Seconds a hole in the feed's offsets may stay open before the index sync skips it
+SEARCH_SYNC_GAP_WAIT = float(os.getenv("SEARCH_SYNC_GAP_WAIT", "5"))
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(value: str | None) -> list:
+    return TOKEN_RE.findall(value.lower()) if value else []
+
+
+class PostgresSearchBackend:
+    """tsvector full-text match plus pg_trgm indexes so '%term%' no longer scans the table."""
+
+    # Matches are filtered, counted and paged in SQL
+    in_process = False
+
+    # Must stay byte-for-byte identical to the indexed expression for the planner to use it
+    TSV_EXPR = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(author, '') || ' ' || coalesce(isbn, ''))"
+
+    def __init__(self):
+        self.trigram = False
+
+    async def start(self):
+        async with async_engine.begin() as conn:
+            try:
+                async with conn.begin_nested():
+                    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                self.trigram = True
+            except Exception:
+                logger.warning("pg_trgm is not available, substring search will not be indexed")
+            await conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_books_search_tsv ON books USING gin ({self.TSV_EXPR})"))
+            if self.trigram:
+                for column in ("title", "author", "isbn"):
+                    await conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_books_{column}_trgm ON books USING gin ({column} gin_trgm_ops)"
+                    ))
+
+    def _tsquery(self, search: str):
+        return func.plainto_tsquery("simple", search)
+
+    def match(self, search: str):
+        return or_(
+            literal_column(self.TSV_EXPR).op("@@")(self._tsquery(search)),
+            Book.title.ilike(f"%{search}%"),
+            Book.author.ilike(f"%{search}%"),
+            Book.isbn.ilike(f"%{search}%")
+        )
+
+    def rank(self, search: str):
+        rank = func.ts_rank(literal_column(self.TSV_EXPR), self._tsquery(search))
+        if self.trigram:
+            rank = rank + func.greatest(
+                func.similarity(Book.title, search),
+                func.similarity(Book.author, search),
+                func.similarity(Book.isbn, search)
+            )
+        return rank
+
+    async def stop(self):
+        pass
+
+    # PostgreSQL maintains its indexes on every write
+    def add(self, book):
+        pass
+
+    def add_many(self, books):
+        pass
+
+    def remove(self, book_id: int):
+        pass
+
+
+class InMemorySearchBackend:
+    """Per-process inverted index for SQLite/local runs.
+
+    Every query token must prefix-match a token of the book's title, author or
+    isbn. Matches are counted and paged here, in (title, id) order (title_page)
+    or by score (ranked_page), so SQL only ever sees the ids of one page.
+
+    Each worker holds its own index: writes it handles update it at once, and
+    a background task applies everyone's writes from the book_events feed.
+    """
+
+    in_process = True
+    FIELD_WEIGHTS = {"title": 2.0, "author": 1.0, "isbn": 1.0}
+
+    def __init__(self):
+        self.postings = {}
+        self.tokens = []
+        self.documents = {}
+        # book id -> (has a title, title, id): SQL's (title, id) order, NULL titles first
+        self.sort_keys = {}
+        self.sync_task = None
+        self.stopping = asyncio.Event()
+
+    async def start(self):
+        self.postings.clear()
+        self.documents.clear()
+        self.sort_keys.clear()
+        async with AsyncSessionLocal() as db:
+            # Read the feed's head first: changes committed during the load are replayed
+            offset = (await db.execute(select(func.max(BookEvent.id)))).scalar() or 0
+            rows = await db.execute(select(Book.id, Book.title, Book.author, Book.isbn))
+            for row in rows:
+                self._index(row.id, {"title": row.title, "author": row.author, "isbn": row.isbn})
+        self.tokens = sorted(self.postings)
+        if self.sync_task is None:
+            self.sync_task = asyncio.create_task(self._follow_events(offset))
+
+    async def stop(self):
+        # Let the sync finish its current poll rather than cancelling it inside a query
+        self.stopping.set()
+        if self.sync_task is not None:
+            await self.sync_task
+            self.sync_task = None
+
+    async def _follow_events(self, offset: int):
+        # (first missing offset, monotonic time it was first seen) of the hole being waited on
+        waiting_gap = None
+        while True:
+            try:
+                await asyncio.wait_for(self.stopping.wait(), SEARCH_SYNC_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                async with AsyncSessionLocal() as db:
+                    page = await read_events(db, offset, MAX_EVENT_PAGE)
+                if offset + 1 < page["first_offset"]:
+                    logger.warning("Book events pruned past offset %d, rebuilding the search index", offset)
+                    self.sync_task = None
+                    await self.start()
+                    return
+                self._apply_events(page["events"])
+                offset = page["next_offset"]
+                gap = page["gap"]
+                if gap:
+                    if waiting_gap is None or waiting_gap[0] != gap[0]:
+                        waiting_gap = (gap[0], time.monotonic())
+                    elif time.monotonic() - waiting_gap[1] >= SEARCH_SYNC_GAP_WAIT:
+                        offset = gap[1]
+                        waiting_gap = None
+            except Exception:
+                logger.exception("Search index sync failed, retrying")
+
+    def _apply_events(self, events: list):
+        latest = {}
+        for event in events:
+            # Availability changes never touch the indexed fields
+            if event["type"] != AVAILABILITY:
+                latest[event["book_id"]] = event
+        for book_id, event in latest.items():
+            if event["type"] == DELETED:
+                self.remove(book_id)
+            else:
+                book = event["book"]
+                self._add(book_id, {"title": book["title"], "author": book["author"], "isbn": book["isbn"]})
+
+    def _index(self, book_id: int, fields: dict) -> list:
+        """Index one document and return the tokens it added to the vocabulary."""
+        document = {field: tokenize(value) for field, value in fields.items()}
+        self.documents[book_id] = document
+        title = fields["title"]
+        self.sort_keys[book_id] = (title is not None, title or "", book_id)
+        new_tokens = []
+        for tokens in document.values():
+            for token in tokens:
+                ids = self.postings.get(token)
+                if ids is None:
+                    ids = self.postings[token] = set()
+                    new_tokens.append(token)
+                ids.add(book_id)
+        return new_tokens
+
+    def add(self, book):
+        self._add(book.id, {"title": book.title, "author": book.author, "isbn": book.isbn})
+
+    def _add(self, book_id: int, fields: dict):
+        self.remove(book_id)
+        for token in self._index(book_id, fields):
+            insort(self.tokens, token)
+
+    def add_many(self, books):
+        # Re-sort the token list once per batch rather than once per book
+        for book in books:
+            self.remove(book.id)
+            self._index(book.id, {"title": book.title, "author": book.author, "isbn": book.isbn})
+        self.tokens = sorted(self.postings)
+
+    def remove(self, book_id: int):
+        document = self.documents.pop(book_id, None)
+        if document is None:
+            return
+        del self.sort_keys[book_id]
+        for tokens in document.values():
+            for token in tokens:
+                ids = self.postings.get(token)
+                if ids is not None:
+                    ids.discard(book_id)
+                    if not ids:
+                        del self.postings[token]
+                        # Drop it from the sorted vocabulary in place, no re-sort per removal
+                        i = bisect_left(self.tokens, token)
+                        if i < len(self.tokens) and self.tokens[i] == token:
+                            del self.tokens[i]
+
+    def _prefix_matches(self, prefix: str) -> set:
+        ids = set()
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            ids |= self.postings[self.tokens[i]]
+            i += 1
+        return ids
+
+    def _matching_ids(self, search: str) -> set:
+        ids = None
+        for token in tokenize(search):
+            matches = self._prefix_matches(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return set()
+        return ids or set()
+
+    def count(self, search: str) -> int:
+        return len(self._matching_ids(search))
+
+    def title_page(self, search: str, offset: int, limit: int, after: tuple | None = None) -> list:
+        """Ids of one page of matches in (title, id) order, past the keyset `after` when given."""
+        keys = (self.sort_keys[book_id] for book_id in self._matching_ids(search))
+        if after is not None:
+            start = (True, *after)
+            keys = (key for key in keys if key > start)
+            offset = 0
+        return [key[2] for key in heapq.nsmallest(offset + limit, keys)[offset:]]
+
+    def _score(self, book_id: int, query_tokens: list) -> float:
+        score = 0.0
+        for field, tokens in self.documents[book_id].items():
+            for token in query_tokens:
+                if token in tokens:
+                    score += self.FIELD_WEIGHTS[field] * 2
+                elif any(t.startswith(token) for t in tokens):
+                    score += self.FIELD_WEIGHTS[field]
+        return score
+
+    def ranked_page(self, search: str, offset: int, limit: int) -> list:
+        """Ids of one page of matches, best score first and then by id.
+
+        Scored and paged here rather than in SQL, where a CASE with one WHEN per
+        match would be evaluated against every row.
+        """
+        query_tokens = tokenize(search)
+        ranked = heapq.nsmallest(offset + limit, ((-self._score(book_id, query_tokens), book_id)
+                                                  for book_id in self._matching_ids(search)))
+        return [book_id for _, book_id in ranked[offset:]]
+
+
+def create_search_backend():
+    backend = SEARCH_BACKEND
+    if backend == "auto":
+        backend = "postgres" if async_engine.dialect.name == "postgresql" else "memory"
+    if backend == "postgres":
+        return PostgresSearchBackend()
+    if backend == "memory":
+        return InMemorySearchBackend()
+    raise ValueError(f"Unknown SEARCH_BACKEND '{SEARCH_BACKEND}'")
+
+
+search_backend = create_search_backend()
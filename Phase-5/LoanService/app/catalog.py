@@ -0,0 +1,343 @@
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, async_engine
+from app.models.catalog import CatalogBook, FeedLease, FeedOffset
+from app.models.loan import Loan
+from app.clients import book_service, get_book_details
+from app.metrics import Gauge, register
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+load_dotenv()
+# Serve book titles and authors from the local replica of BookService's catalog,
+# kept current by consuming its change feed (GET /api/books/events)
+CATALOG_REPLICA_ENABLED = os.getenv("CATALOG_REPLICA_ENABLED", "true").lower() in ("1", "true", "yes")
+# Seconds between feed polls once caught up
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "0.5"))
+# Events per poll; must not exceed MAX_EVENT_PAGE in BookService
+CATALOG_BATCH_SIZE = int(os.getenv("CATALOG_BATCH_SIZE", "500"))
+# Books per page while bootstrapping from the catalog listing; must not exceed MAX_PER_PAGE in BookService
+CATALOG_BOOTSTRAP_PAGE = int(os.getenv("CATALOG_BOOTSTRAP_PAGE", "1000"))
+# Seconds a hole in the feed's offsets may stay open, timed on this process's clock from
+# when it was first seen, before it is taken for a rolled-back transaction and skipped
+CATALOG_GAP_WAIT = float(os.getenv("CATALOG_GAP_WAIT", "5"))
+# Seconds between full re-copies of the catalog, which repair any change the feed
+# missed (a skipped hole whose transaction committed after all); 0 disables them
+CATALOG_RECONCILE_INTERVAL = float(os.getenv("CATALOG_RECONCILE_INTERVAL", "3600"))
+# Only the worker holding the feed lease consumes it; the others take over once it has
+# gone this many seconds without being renewed
+CATALOG_LEASE_SECONDS = float(os.getenv("CATALOG_LEASE_SECONDS", "30"))
+
+FEED_NAME = "book_events"
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+BOOK_FIELDS = ("id", "title", "author", "isbn", "copies", "available_copies")
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationStatus:
+    def __init__(self):
+        self.applied_offset = None
+        self.head_offset = None
+        # Epoch seconds at which the replica last held every event published so far
+        self.complete_as_of = None
+        self.leader = False
+        self.events_applied = 0
+        self.bootstraps = 0
+        self.gaps_skipped = 0
+        self.errors = 0
+
+    def lag_seconds(self):
+        return None if self.complete_as_of is None else max(time.time() - self.complete_as_of, 0.0)
+
+    def lag_events(self):
+        if self.applied_offset is None or self.head_offset is None:
+            return None
+        return max(self.head_offset - self.applied_offset, 0)
+
+    def stats(self) -> dict:
+        lag = self.lag_seconds()
+        return {
+            "enabled": CATALOG_REPLICA_ENABLED,
+            "leader": self.leader,
+            "applied_offset": self.applied_offset,
+            "head_offset": self.head_offset,
+            "lag_events": self.lag_events(),
+            "lag_seconds": round(lag, 3) if lag is not None else None,
+            "events_applied": self.events_applied,
+            "bootstraps": self.bootstraps,
+            "gaps_skipped": self.gaps_skipped,
+            "errors": self.errors,
+        }
+
+
+status = ReplicationStatus()
+
+
+def _present(value):
+    return {(): value} if value is not None else {}
+
+
+register(Gauge("catalog_replication_lag_seconds",
+               "Seconds since the book catalog replica last held every published change",
+               collect=lambda: _present(status.lag_seconds())))
+register(Gauge("catalog_replication_lag_events", "Book change events published but not yet applied locally",
+               collect=lambda: _present(status.lag_events())))
+
+
+def catalog_join(query):
+    """Add the replica's title and author to a select over Loan (NULL when not replicated)."""
+    if not CATALOG_REPLICA_ENABLED:
+        return query
+    return query.add_columns(CatalogBook.title, CatalogBook.author).outerjoin(
+        CatalogBook, and_(CatalogBook.id == Loan.book_id, CatalogBook.deleted.is_(False))
+    )
+
+
+def local_book(book_id: int, row) -> dict | None:
+    title = getattr(row, "title", None)
+    if title is None:
+        return None
+    return {"id": book_id, "title": title, "author": row.author}
+
+
+async def book_details(rows) -> dict:
+    """Book details for rows from a catalog_join query; books the replica lacks
+    (not replicated yet, or deleted) fall back to BookService."""
+    books = {}
+    for row in rows:
+        if row.book_id not in books:
+            book = local_book(row.book_id, row)
+            if book is not None:
+                books[row.book_id] = book
+    missing = [row.book_id for row in rows if row.book_id not in books]
+    if missing:
+        for book_id, book in (await get_book_details(missing)).items():
+            books[book_id] = book.dict()
+    return books
+
+
+def _insert():
+    return postgresql_insert if async_engine.dialect.name == "postgresql" else sqlite_insert
+
+
+async def _upsert_books(db: AsyncSession, rows: list, copy: bool = False):
+    if not rows:
+        return
+    statement = _insert()(CatalogBook)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={column: excluded[column] for column in BOOK_FIELDS[1:] + ("version", "deleted")},
+        # A copy is read after its version's event committed, so it also replaces rows at that version
+        where=CatalogBook.version <= excluded.version if copy else CatalogBook.version < excluded.version,
+    )
+    await db.execute(statement, rows)
+
+
+async def _save_offset(db: AsyncSession, offset: int):
+    statement = _insert()(FeedOffset).values(name=FEED_NAME, applied_offset=offset, updated_at=time.time())
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"applied_offset": statement.excluded.applied_offset, "updated_at": statement.excluded.updated_at},
+        where=FeedOffset.applied_offset < statement.excluded.applied_offset,
+    ))
+
+
+async def apply_events(db: AsyncSession, events: list, offset: int):
+    """Apply one page of events and record the new offset in the same transaction."""
+    latest = {}
+    for event in events:
+        # Events carry the full book state, so only each book's last event matters
+        latest[event["book_id"]] = event
+    rows = []
+    for event in latest.values():
+        deleted = event["type"] == "deleted"
+        book = event["book"] or {}
+        row = {field: book.get(field) for field in BOOK_FIELDS}
+        row.update(id=event["book_id"], version=event["offset"], deleted=deleted)
+        rows.append(row)
+    await _upsert_books(db, rows)
+    await _save_offset(db, offset)
+    await db.commit()
+
+
+async def fetch_events(after: int, limit: int = CATALOG_BATCH_SIZE) -> dict:
+    response = await book_service.request("GET", "/api/books/events", params={"after": after, "limit": limit})
+    response.raise_for_status()
+    return response.json()
+
+
+class FeedLeaseHolder:
+    """Elects one consumer per database: a worker consumes only while it holds
+    the feed_leases row, renewing it well before it expires. A consumer stalled
+    past its lease may overlap briefly with its successor, which the version
+    checks make harmless."""
+
+    def __init__(self):
+        self.expires_at = 0.0
+        self.checked_at = 0.0
+
+    async def held(self) -> bool:
+        now = time.time()
+        if self.expires_at - now > CATALOG_LEASE_SECONDS * 2 / 3:
+            return True
+        if not self.expires_at and now - self.checked_at < CATALOG_LEASE_SECONDS / 3:
+            # Not the consumer: look again a few times per lease period
+            return False
+        self.checked_at = now
+        async with AsyncSessionLocal() as db:
+            await db.execute(_insert()(FeedLease).values(name=FEED_NAME, owner=WORKER_ID, expires_at=0)
+                             .on_conflict_do_nothing(index_elements=["name"]))
+            result = await db.execute(
+                update(FeedLease)
+                .where(FeedLease.name == FEED_NAME, or_(FeedLease.owner == WORKER_ID, FeedLease.expires_at < now))
+                .values(owner=WORKER_ID, expires_at=now + CATALOG_LEASE_SECONDS)
+            )
+            await db.commit()
+        self.expires_at = now + CATALOG_LEASE_SECONDS if result.rowcount == 1 else 0.0
+        return bool(self.expires_at)
+
+
+feed_lease = FeedLeaseHolder()
+
+
+async def resume_offset(applied: int | None = None) -> int:
+    """The offset a copy taken now is current as of.
+
+    On PostgreSQL an event below the head may still be uncommitted (ids are
+    handed out at insert time), and a copy taken now would not include it. So
+    stop in front of the first hole among the last CATALOG_BATCH_SIZE offsets;
+    the feed replays from there, and the consumer waits for the hole as usual.
+    Holes at or below the applied offset were already waited out and are ignored.
+    """
+    head_page = await fetch_events(0, limit=0)
+    head = head_page["head_offset"]
+    after = max(head - CATALOG_BATCH_SIZE, head_page["first_offset"] - 1, applied or 0, 0)
+    if after >= head:
+        return head
+    gap = (await fetch_events(after))["gap"]
+    return gap[0] - 1 if gap and gap[0] <= head else head
+
+
+async def bootstrap(applied: int | None = None) -> int:
+    """Copy the whole catalog, then resume the feed from the offset read before the copy.
+
+    The copy is stamped with that offset, so changes made while copying (and
+    events still uncommitted at the start) are replayed over it; the version
+    check keeps each row at its newest state either way. Also run every
+    CATALOG_RECONCILE_INTERVAL to repair changes the feed skipped.
+    """
+    head = await resume_offset(applied)
+    cursor = None
+    copied = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            params = {"per_page": CATALOG_BOOTSTRAP_PAGE, "include_total": "false"}
+            if cursor:
+                params["after"] = cursor
+            response = await book_service.request("GET", "/api/books/", params=params)
+            response.raise_for_status()
+            page = response.json()
+            if not await feed_lease.held():
+                raise RuntimeError("Lost the book change feed lease while bootstrapping")
+            rows = [dict({field: book[field] for field in BOOK_FIELDS}, version=head, deleted=False)
+                    for book in page["books"]]
+            await _upsert_books(db, rows, copy=True)
+            await db.commit()
+            copied += len(rows)
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        # Rows the copy did not refresh belong to books deleted before it started
+        await db.execute(update(CatalogBook).where(CatalogBook.version < head).values(deleted=True))
+        await _save_offset(db, head)
+        await db.commit()
+    status.bootstraps += 1
+    logger.info("Bootstrapped book catalog replica: %d books at offset %d", copied, head)
+    return head
+
+
+async def load_offset() -> int | None:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(FeedOffset.applied_offset).filter(FeedOffset.name == FEED_NAME)
+        )).scalar()
+
+
+async def consume_feed():
+    """Keep the replica current; runs for the life of the process in every worker,
+    but only the lease holder reads the feed and runs the periodic reconcile."""
+    offset = None
+    # (first missing offset, monotonic time it was first seen) of the hole we are waiting on
+    waiting_gap = None
+    reconciled_at = time.monotonic()
+    while True:
+        try:
+            if not await feed_lease.held():
+                if status.leader:
+                    logger.info("Lost the book change feed lease")
+                    # Lag is the consumer's to report; a follower's figures would only go stale
+                    status.applied_offset = status.head_offset = status.complete_as_of = None
+                status.leader = False
+                # Another worker's progress: reload the offset if this one takes over
+                offset = None
+                await asyncio.sleep(CATALOG_POLL_INTERVAL)
+                continue
+            if not status.leader:
+                logger.info("Consuming the book change feed as %s", WORKER_ID)
+                status.leader = True
+            if offset is None:
+                offset = await load_offset()
+            if offset is None:
+                offset = await bootstrap()
+                reconciled_at = time.monotonic()
+            if CATALOG_RECONCILE_INTERVAL > 0 and time.monotonic() - reconciled_at >= CATALOG_RECONCILE_INTERVAL:
+                offset = await bootstrap(offset)
+                reconciled_at = time.monotonic()
+                waiting_gap = None
+            polled_at = time.time()
+            page = await fetch_events(offset)
+            if offset + 1 < page["first_offset"]:
+                # Events we never applied have been pruned: start over from a copy
+                logger.warning("Book change feed pruned past offset %d, re-bootstrapping", offset)
+                offset = await bootstrap()
+                continue
+            if page["events"]:
+                async with AsyncSessionLocal() as db:
+                    await apply_events(db, page["events"], page["next_offset"])
+                status.events_applied += len(page["events"])
+                offset = page["next_offset"]
+            gap = page["gap"]
+            if gap:
+                if waiting_gap is None or waiting_gap[0] != gap[0]:
+                    waiting_gap = (gap[0], time.monotonic())
+                elif time.monotonic() - waiting_gap[1] >= CATALOG_GAP_WAIT:
+                    # Most likely a rollback; if it commits later, the next reconcile picks it up
+                    logger.warning("Skipping offsets %d-%d of the book change feed, missing for %.1f s",
+                                   gap[0], gap[1], time.monotonic() - waiting_gap[1])
+                    async with AsyncSessionLocal() as db:
+                        await apply_events(db, [], gap[1])
+                    status.gaps_skipped += 1
+                    offset = gap[1]
+                    waiting_gap = None
+                    continue
+            status.applied_offset = offset
+            status.head_offset = page["head_offset"]
+            if offset >= page["head_offset"]:
+                # Everything published before the poll is applied
+                status.complete_as_of = polled_at
+            if len(page["events"]) < CATALOG_BATCH_SIZE:
+                await asyncio.sleep(CATALOG_POLL_INTERVAL)
+        except Exception:
+            status.errors += 1
+            logger.exception("Book catalog replication failed, retrying")
+            offset = None
+            await asyncio.sleep(CATALOG_POLL_INTERVAL)
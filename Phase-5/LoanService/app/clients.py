@@ -0,0 +1,340 @@
+from fastapi import HTTPException
+import httpx
+from app.concurrency import bounded_fan_out, SingleFlight
+from app.cache import TTLCache, NOT_FOUND
+from app.metrics import observe_downstream
+from app.resilience import Guard, ReadPolicy
+from app.tracing import span, trace_headers
+from app.schemas.loan import UserDetail, BookDetail
+from dotenv import load_dotenv
+import logging
+import os
+import time
+
+load_dotenv()
+USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
+BOOK_SERVICE_URL = os.getenv("BOOK_SERVICE_URL")
+
+# Connection pool settings shared by every downstream client
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+# Concurrent identical GETs to the same service share one request
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Per-service timeouts (seconds)
+USER_SERVICE_TIMEOUT = float(os.getenv("USER_SERVICE_TIMEOUT", "5.0"))
+BOOK_SERVICE_TIMEOUT = float(os.getenv("BOOK_SERVICE_TIMEOUT", "5.0"))
+
+# Read-through cache for the UserDetail/BookDetail projections (TTLs in seconds)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+BOOK_CACHE_TTL = float(os.getenv("BOOK_CACHE_TTL", "300"))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceClient:
+    """One long-lived httpx.AsyncClient per downstream service."""
+
+    def __init__(self, name: str, base_url: str, timeout: float):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.client: httpx.AsyncClient | None = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+        self.flights = SingleFlight(name)
+        self.guard = Guard(name)
+        self.reads = ReadPolicy(name)
+
+    async def start(self, transport: httpx.AsyncBaseTransport | None = None):
+        http2 = HTTP2_ENABLED
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("HTTP2_ENABLED is set but 'h2' is not installed, falling back to HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url or "",
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+            transport=transport,
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.client is None:
+            raise RuntimeError(f"{self.name} client is not started")
+        if method != "GET":
+            return await self._send(method, url, **kwargs)
+        # GETs are idempotent: they may be hedged or retried, and one response
+        # (or error) can answer every concurrent caller asking the same thing
+        def read():
+            return self.reads.call(lambda: self._send(method, url, **kwargs))
+
+        if SINGLEFLIGHT_ENABLED and set(kwargs) <= {"params"}:
+            params = kwargs.get("params")
+            key = (url, tuple(sorted(params.items())) if params else ())
+            return await self.flights.do(key, read)
+        return await read()
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Fails fast with a TransportError while the service is unhealthy or saturated
+        async with self.guard.call() as call:
+            response = await self._send_unguarded(method, url, **kwargs)
+            call.failed = response.status_code >= 500
+            return response
+
+    async def _send_unguarded(self, method: str, url: str, **kwargs) -> httpx.Response:
+        self.in_flight += 1
+        self.total_requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            with span(f"{self.name} {method} {url}", "client", **{"peer.service": self.name}) as client_span:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), **trace_headers(client_span)}
+                response = await self.client.request(method, url, **kwargs)
+                status = response.status_code
+                if client_span is not None:
+                    client_span.attributes["http.status_code"] = status
+            return response
+        finally:
+            self.in_flight -= 1
+            observe_downstream(self.name, method, status, time.perf_counter() - started)
+
+    def pool_stats(self) -> dict:
+        # httpcore does not expose pool occupancy publicly, so read it off the transport
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "service": self.name,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+            "singleflight": self.flights.stats(),
+            **self.guard.stats(),
+            "reads": self.reads.stats(),
+        }
+
+
+user_service = ServiceClient("user", USER_SERVICE_URL, USER_SERVICE_TIMEOUT)
+book_service = ServiceClient("book", BOOK_SERVICE_URL, BOOK_SERVICE_TIMEOUT)
+SERVICE_CLIENTS = [user_service, book_service]
+
+
+async def start_clients():
+    for service in SERVICE_CLIENTS:
+        await service.start()
+
+
+async def close_clients():
+    for service in SERVICE_CLIENTS:
+        await service.close()
+
+
+def pool_stats():
+    return {service.name: service.pool_stats() for service in SERVICE_CLIENTS}
+
+
+async def get_user(user_id: int):
+    try:
+        response = await user_service.request("GET", f"/api/users/{user_id}")
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=503, detail="User Service unavailable")
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="User Service unavailable")
+
+
+async def get_book(book_id: int):
+    try:
+        response = await book_service.request("GET", f"/api/books/{book_id}")
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Book not found")
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+
+
+async def reserve_book(book_id: int):
+    try:
+        response = await book_service.request("POST", f"/api/books/{book_id}/reserve")
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Book not found")
+        if e.response.status_code == 400:
+            raise HTTPException(status_code=400, detail="No available copies of the book")
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+
+
+def _error_detail(response: httpx.Response, default: str) -> str:
+    """The detail of a FastAPI error body, or default when the body is not one (e.g. from a proxy)."""
+    try:
+        detail = response.json().get("detail")
+    except (ValueError, AttributeError):
+        return default
+    return detail if isinstance(detail, str) else default
+
+
+# BookService's 400 detail when a book has no copy out to release, e.g. after
+# PUT /books/{id} reset available_copies to copies
+ALL_COPIES_AVAILABLE = "All copies already available"
+
+
+async def release_book(book_id: int):
+    try:
+        response = await book_service.request("POST", f"/api/books/{book_id}/release")
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (400, 404):
+            raise HTTPException(status_code=e.response.status_code,
+                                detail=_error_detail(e.response, "Book Service refused the release"))
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+
+
+async def _adjust_books(path: str, book_ids) -> dict:
+    try:
+        response = await book_service.request("POST", path, json={"book_ids": list(book_ids)})
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPStatusError, httpx.RequestError):
+        raise HTTPException(status_code=503, detail="Book Service unavailable")
+
+
+async def reserve_books(book_ids) -> dict:
+    """Take one copy per listed id in a single call; per-book failures come back in "failed"."""
+    return await _adjust_books("/api/books/batch/reserve", book_ids)
+
+
+async def release_books(book_ids) -> dict:
+    return await _adjust_books("/api/books/batch/release", book_ids)
+
+
+# Must match MAX_BATCH_IDS in the User and Book services
+BATCH_MAX_IDS = 500
+
+
+async def _get_batch(service: ServiceClient, path: str, ids, unavailable: str) -> dict:
+    unique_ids = list(dict.fromkeys(ids))
+    chunks = [unique_ids[i:i + BATCH_MAX_IDS] for i in range(0, len(unique_ids), BATCH_MAX_IDS)]
+
+    async def fetch(chunk):
+        try:
+            response = await service.request("GET", path, params={"ids": ",".join(map(str, chunk))})
+            response.raise_for_status()
+        except (httpx.HTTPStatusError, httpx.RequestError):
+            raise HTTPException(status_code=503, detail=unavailable)
+        return response.json()
+
+    results = {}
+    for items in await bounded_fan_out(fetch, chunks):
+        for item in items:
+            results[item["id"]] = item
+    return results
+
+
+async def get_users_batch(user_ids) -> dict:
+    return await _get_batch(user_service, "/api/users/batch", user_ids, "User Service unavailable")
+
+
+async def get_books_batch(book_ids) -> dict:
+    return await _get_batch(book_service, "/api/books/batch", book_ids, "Book Service unavailable")
+
+
+user_cache = TTLCache("user", CACHE_MAX_ENTRIES, USER_CACHE_TTL, NEGATIVE_CACHE_TTL)
+book_cache = TTLCache("book", CACHE_MAX_ENTRIES, BOOK_CACHE_TTL, NEGATIVE_CACHE_TTL)
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (user_cache, book_cache)}
+
+
+async def _get_detail(cache: TTLCache, fetch, schema, key: int, not_found: str):
+    cached = cache.get(key)
+    if cached is NOT_FOUND:
+        raise HTTPException(status_code=404, detail=not_found)
+    if cached is not None:
+        return cached
+    try:
+        data = await fetch(key)
+    except HTTPException as e:
+        if e.status_code == 404:
+            cache.set(key, NOT_FOUND)
+        raise
+    detail = schema(**data)
+    cache.set(key, detail)
+    return detail
+
+
+async def get_user_detail(user_id: int) -> UserDetail:
+    return await _get_detail(user_cache, get_user, UserDetail, user_id, "User not found")
+
+
+async def get_book_detail(book_id: int) -> BookDetail:
+    return await _get_detail(book_cache, get_book, BookDetail, book_id, "Book not found")
+
+
+async def _get_details(cache: TTLCache, fetch_batch, schema, ids) -> dict:
+    """Resolve many ids through the cache, batching the misses into one lookup.
+
+    Ids the owning service does not know are cached as 404s and left out of the result.
+    """
+    details = {}
+    missing = []
+    for key in dict.fromkeys(ids):
+        cached = cache.get(key)
+        if cached is None:
+            missing.append(key)
+        elif cached is not NOT_FOUND:
+            details[key] = cached
+    if missing:
+        found = await fetch_batch(missing)
+        for key in missing:
+            if key in found:
+                details[key] = schema(**found[key])
+                cache.set(key, details[key])
+            else:
+                cache.set(key, NOT_FOUND)
+    return details
+
+
+async def get_user_details(user_ids) -> dict:
+    return await _get_details(user_cache, get_users_batch, UserDetail, user_ids)
+
+
+async def get_book_details(book_ids) -> dict:
+    return await _get_details(book_cache, get_books_batch, BookDetail, book_ids)
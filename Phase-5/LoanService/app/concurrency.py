@@ -0,0 +1,91 @@
+from app.metrics import Counter, register
+import asyncio
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "8"))
+
+
+async def fan_out(*aws):
+    """Run independent awaitables concurrently and return their results in order.
+
+    The first failure cancels whatever is still running and is re-raised as is,
+    so an HTTPException keeps its 404/503 status. When several calls have
+    already failed, the one passed first wins, matching the old sequential order.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    if pending:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    for task in tasks:
+        if task in done and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+async def bounded_fan_out(func, items, limit: int = FANOUT_CONCURRENCY):
+    """Call func(item) for every item with at most `limit` calls in flight."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await fan_out(*(run(item) for item in items))
+
+
+singleflight_calls = register(Counter(
+    "downstream_singleflight_calls_total",
+    "Downstream lookups that started a request (leader) or joined one already in flight (collapsed)",
+    ("service", "result")))
+
+
+class SingleFlight:
+    """Collapses concurrent identical calls into one in-flight task.
+
+    The first caller for a key starts the call; everyone asking for the same key
+    before it finishes awaits the same task and gets its result or its exception.
+    The task is shielded, so a cancelled caller does not cancel it for the rest.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.flights = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    async def do(self, key, func):
+        self.calls += 1
+        task = self.flights.get(key)
+        if task is None:
+            task = self.flights[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._finish(key, done))
+            singleflight_calls.inc(self.name, "leader")
+        else:
+            self.collapsed += 1
+            singleflight_calls.inc(self.name, "collapsed")
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller has gone away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "in_flight": len(self.flights),
+        }
@@ -0,0 +1,8 @@
+from sqlalchemy import func, select
+from app.models.loan import Loan, LoanStatus
+
+# Each counter and the full-scan query that rebuilds it
+COUNTERS = {
+    "total_loans": select(func.count(Loan.id)),
+    "active_loans": select(func.count(Loan.id)).filter(Loan.status == LoanStatus.ACTIVE),
+}
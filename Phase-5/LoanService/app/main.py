@@ -1,9 +1,59 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routes import loans
-from app.database import Base, engine
+from app.database import Base, engine, pool_stats as db_pool_stats
+from app.migrations import run_migrations
+from app.clients import start_clients, close_clients, pool_stats, cache_stats
+from app.metrics import MetricsMiddleware, instrument_engines, metrics_response
+from app.tracing import TracingMiddleware, close_exporter, trace_engines
+from app.stats import ensure_counters, reconcile_periodically, STATS_RECONCILE_INTERVAL
+from app.catalog import consume_feed, CATALOG_REPLICA_ENABLED, status as catalog_status
+import asyncio
 
-Base.metadata.create_all(bind=engine)
+run_migrations(engine, Base.metadata)
+instrument_engines()
+trace_engines()
 
-app = FastAPI(title="Loan Service", 
-              root_path="/api/loans")
-app.include_router(loans.router)
\ No newline at end of file
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_clients()
+    await ensure_counters()
+    reconciler = asyncio.create_task(reconcile_periodically()) if STATS_RECONCILE_INTERVAL > 0 else None
+    replicator = asyncio.create_task(consume_feed()) if CATALOG_REPLICA_ENABLED else None
+    yield
+    if reconciler:
+        reconciler.cancel()
+    if replicator:
+        replicator.cancel()
+    close_exporter()
+    await close_clients()
+
+app = FastAPI(title="Loan Service",
+              root_path="/api/loans",
+              lifespan=lifespan)
+
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="loan-service")
+
+# Registered before the router so "/{id}" does not shadow them
+@app.get("/pool-stats")
+def get_pool_stats():
+    return pool_stats()
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics_response()
+
+@app.get("/db-pool-stats")
+def get_db_pool_stats():
+    return db_pool_stats()
+
+@app.get("/cache-stats")
+def get_cache_stats():
+    return cache_stats()
+
+@app.get("/catalog-stats")
+def get_catalog_stats():
+    return catalog_status.stats()
+
+app.include_router(loans.router)
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, Float, Boolean, BigInteger
+from app.database import Base
+
+# Local read model of BookService's catalog, fed by its change events
+class CatalogBook(Base):
+    __tablename__ = "catalog_books"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String)
+    author = Column(String)
+    isbn = Column(String)
+    copies = Column(Integer)
+    available_copies = Column(Integer)
+    # Feed offset of the event that wrote this row; older events never overwrite it
+    version = Column(BigInteger, nullable=False)
+    # Deleted books stay as tombstones so a late, older event cannot bring them back
+    deleted = Column(Boolean, nullable=False, default=False)
+
+# Last change feed offset applied to the read model
+class FeedOffset(Base):
+    __tablename__ = "feed_offsets"
+
+    name = Column(String, primary_key=True)
+    applied_offset = Column(BigInteger, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+# Which worker consumes a feed: the one holding an unexpired lease
+class FeedLease(Base):
+    __tablename__ = "feed_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)
@@ -0,0 +1,20 @@
+# Shared module: LoanService/app/pagination.py is the canonical copy and BookService
+# carries an identical one. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from fastapi import HTTPException
+import base64
+import json
+
+# Opaque keyset cursors: the sort key of the last row on a page, base64 encoded
+
+def encode_cursor(*key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode()
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
@@ -0,0 +1,398 @@
+from app.metrics import Counter, Gauge, register
+from collections import deque
+from dotenv import load_dotenv
+import asyncio
+import httpx
+import logging
+import os
+import random
+import time
+
+load_dotenv()
+# Circuit breaker: open when at least CIRCUIT_FAILURE_RATE of the calls in the last
+# CIRCUIT_WINDOW_SECONDS failed (and there were at least CIRCUIT_MIN_CALLS of them)
+CIRCUIT_ENABLED = os.getenv("CIRCUIT_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "10"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+# Calls slower than this count as failures even when they succeed
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "2.5"))
+# How long an open circuit rejects calls before letting probes through
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "5"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+# Bulkhead: concurrent calls allowed per downstream service, and how long a call
+# may wait for a slot before it is rejected
+BULKHEAD_MAX_CONCURRENT = int(os.getenv("BULKHEAD_MAX_CONCURRENT", "50"))
+BULKHEAD_MAX_WAIT = float(os.getenv("BULKHEAD_MAX_WAIT", "0.05"))
+
+# Hedging: when a GET has not answered within HEDGE_PERCENTILE of the service's
+# recent GET latencies, send a second copy and take whichever answers first
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.005"))
+# Latencies needed before the percentile is trusted; no hedging until then
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "512"))
+
+# Retries for GETs that could not connect, with full-jitter exponential backoff.
+# RETRY_MAX_ATTEMPTS counts every attempt, the first one included (1 disables retries)
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.05"))
+# Retries and hedges together may add at most this fraction of extra requests,
+# plus RETRY_BUDGET_MIN_PER_SECOND so a quiet service can still retry
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "5"))
+
+# Failures where the request certainly never reached the service
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Raised instead of calling a service whose circuit is open.
+
+    A TransportError, so the client functions map it to 503 like any other
+    unreachable dependency.
+    """
+
+
+class BulkheadFullError(httpx.TransportError):
+    """Raised when a service already has its maximum number of calls in flight."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        # (finished at, failed) for calls inside the window
+        self.outcomes = deque()
+        self.failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= CIRCUIT_HALF_OPEN_PROBES:
+                return False
+            self.probes += 1
+        return True
+
+    def release_probe(self):
+        self.probes = max(self.probes - 1, 0)
+
+    def record(self, failed: bool, probe: bool):
+        if probe:
+            self.release_probe()
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                elif self.probes == 0:
+                    self._transition(CLOSED)
+            return
+        if self.state != CLOSED:
+            # Let through before the circuit opened and finished late
+            return
+        now = time.monotonic()
+        self.outcomes.append((now, failed))
+        self.failures += failed
+        self._expire(now)
+        calls = len(self.outcomes)
+        if calls >= CIRCUIT_MIN_CALLS and self.failures / calls >= CIRCUIT_FAILURE_RATE:
+            self._open()
+
+    def _expire(self, now: float):
+        while self.outcomes and now - self.outcomes[0][0] > CIRCUIT_WINDOW_SECONDS:
+            _, failed = self.outcomes.popleft()
+            self.failures -= failed
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning("Circuit for %s service %s -> %s", self.name, self.state, state)
+        self.state = state
+        self.probes = 0
+        self.outcomes.clear()
+        self.failures = 0
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {
+            "state": self.state,
+            "window_calls": len(self.outcomes),
+            "window_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class Bulkhead:
+    def __init__(self, name: str, max_concurrent: int = BULKHEAD_MAX_CONCURRENT):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.rejected = 0
+
+    async def acquire(self) -> bool:
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+        else:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), BULKHEAD_MAX_WAIT)
+            except asyncio.TimeoutError:
+                return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {"max_concurrent": self.max_concurrent, "active": self.active, "rejected": self.rejected}
+
+
+downstream_rejected = register(Counter(
+    "downstream_rejected_total", "Downstream calls failed fast without being sent", ("service", "reason")))
+GUARDS = []
+
+
+def _circuit_states():
+    return {(guard.name,): STATE_VALUES[guard.breaker.state] for guard in GUARDS}
+
+
+register(Gauge("downstream_circuit_state", "Circuit breaker state per service (0 closed, 1 half-open, 2 open)",
+               ("service",), collect=_circuit_states))
+
+
+class Guard:
+    """Circuit breaker plus bulkhead for one downstream service.
+
+        async with guard.call() as call:
+            response = await client.request(...)
+            call.failed = response.status_code >= 500
+
+    Entering raises CircuitOpenError or BulkheadFullError without touching the
+    network; leaving records the outcome (an exception, a 5xx flagged through
+    `failed`, or a call slower than CIRCUIT_SLOW_CALL_SECONDS is a failure).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.bulkhead = Bulkhead(name)
+        GUARDS.append(self)
+
+    def call(self):
+        return _GuardedCall(self)
+
+    def stats(self) -> dict:
+        return {"circuit": self.breaker.stats(), "bulkhead": self.bulkhead.stats()}
+
+
+class _GuardedCall:
+    __slots__ = ("guard", "failed", "probe", "started")
+
+    def __init__(self, guard: Guard):
+        self.guard = guard
+        self.failed = False
+        self.probe = False
+
+    async def __aenter__(self):
+        guard = self.guard
+        if CIRCUIT_ENABLED and not guard.breaker.allow():
+            guard.breaker.rejected += 1
+            downstream_rejected.inc(guard.name, "circuit_open")
+            raise CircuitOpenError(f"{guard.name} service circuit is open")
+        self.probe = CIRCUIT_ENABLED and guard.breaker.state == HALF_OPEN
+        try:
+            acquired = await guard.bulkhead.acquire()
+        except BaseException:
+            if self.probe:
+                guard.breaker.release_probe()
+            raise
+        if not acquired:
+            if self.probe:
+                # Give the probe slot back; this call never reached the service
+                guard.breaker.release_probe()
+            guard.bulkhead.rejected += 1
+            downstream_rejected.inc(guard.name, "bulkhead_full")
+            raise BulkheadFullError(f"{guard.name} service has too many calls in flight")
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        guard = self.guard
+        guard.bulkhead.release()
+        if not CIRCUIT_ENABLED:
+            return False
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            # Cancelled by our own caller: says nothing about the service's health
+            if self.probe:
+                guard.breaker.release_probe()
+            return False
+        slow = time.perf_counter() - self.started > CIRCUIT_SLOW_CALL_SECONDS
+        guard.breaker.record(exc_type is not None or self.failed or slow, self.probe)
+        return False
+
+
+downstream_hedges = register(Counter(
+    "downstream_hedges_total", "Hedged second requests sent, and how many answered first", ("service", "result")))
+downstream_retries = register(Counter(
+    "downstream_retries_total", "Downstream GETs retried after a connection error", ("service",)))
+retry_budget_exhausted = register(Counter(
+    "downstream_retry_budget_exhausted_total", "Retries or hedges skipped because the budget was spent",
+    ("service",)))
+
+
+class RetryBudget:
+    """Token bucket shared by retries and hedges.
+
+    Every request deposits RETRY_BUDGET_RATIO of a token and the bucket also
+    refills at RETRY_BUDGET_MIN_PER_SECOND; each extra request takes a whole one.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        # Room for about ten seconds' worth of the floor rate
+        self.capacity = max(min_per_second * 10, 1.0)
+        self.balance = self.capacity
+        self.refilled_at = time.monotonic()
+
+    def deposit(self):
+        self.balance = min(self.balance + self.ratio, self.capacity)
+
+    def withdraw(self) -> bool:
+        now = time.monotonic()
+        self.balance = min(self.balance + (now - self.refilled_at) * self.min_per_second, self.capacity)
+        self.refilled_at = now
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class LatencyWindow:
+    """The last HEDGE_WINDOW latencies, with the hedge delay recomputed every few samples."""
+
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self.samples = deque(maxlen=size)
+        self.added = 0
+        self.delay = None
+
+    def add(self, elapsed: float):
+        self.samples.append(elapsed)
+        self.added += 1
+        if len(self.samples) >= HEDGE_MIN_SAMPLES and (self.delay is None or self.added % 32 == 0):
+            ordered = sorted(self.samples)
+            index = min(int(len(ordered) * HEDGE_PERCENTILE), len(ordered) - 1)
+            self.delay = max(ordered[index], HEDGE_MIN_DELAY)
+
+
+class ReadPolicy:
+    """Hedging and retries for idempotent reads to one downstream service.
+
+    `send` is a zero-argument coroutine function making one attempt; it may be
+    called several times, concurrently when hedging.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.budget = RetryBudget()
+        self.latencies = LatencyWindow()
+        self.hedges = 0
+        self.hedges_won = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    async def call(self, send):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged(send)
+            except RETRYABLE_ERRORS:
+                if attempt + 1 >= RETRY_MAX_ATTEMPTS or not self._withdraw():
+                    raise
+            attempt += 1
+            self.retries += 1
+            downstream_retries.inc(self.name)
+            await asyncio.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+    def _withdraw(self) -> bool:
+        if self.budget.withdraw():
+            return True
+        self.budget_exhausted += 1
+        retry_budget_exhausted.inc(self.name)
+        return False
+
+    async def _timed(self, send):
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            # A hedge loser took at least this long; leaving it out would bias the
+            # window toward the fast attempts and pull the hedge delay down
+            self.latencies.add(time.perf_counter() - started)
+            raise
+        self.latencies.add(time.perf_counter() - started)
+        return response
+
+    async def _hedged(self, send):
+        delay = self.latencies.delay if HEDGE_ENABLED else None
+        if delay is None:
+            return await self._timed(send)
+        first = asyncio.ensure_future(self._timed(send))
+        attempts = [first]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done or not self._withdraw():
+                return await first
+            attempts.append(asyncio.ensure_future(self._timed(send)))
+            self.hedges += 1
+            downstream_hedges.inc(self.name, "sent")
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in attempts:
+                    if attempt in done and attempt.exception() is None:
+                        if attempt is not first:
+                            self.hedges_won += 1
+                            downstream_hedges.inc(self.name, "won")
+                        return attempt.result()
+            # Both attempts failed: report the original one's error
+            raise first.exception()
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+            for attempt in attempts:
+                # Losers' errors are expected; keep asyncio from logging them
+                if attempt.done() and not attempt.cancelled():
+                    attempt.exception()
+
+    def stats(self) -> dict:
+        return {
+            "hedge_delay_ms": round(self.latencies.delay * 1000, 3) if self.latencies.delay else None,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "retries": self.retries,
+            "budget_exhausted": self.budget_exhausted,
+            "budget_balance": round(self.budget.balance, 2),
+        }
@@ -1,140 +1,345 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import literal_column, select, tuple_, update
 from sqlalchemy.sql import func
-from app.database import get_db
+from app.database import get_async_db
 from app.models.loan import Loan, LoanStatus
-from app.schemas.loan import LoanCreate, LoanReturn, LoanResponse, LoanDetailResponse, LoanHistoryResponse, BookDetail, UserDetail
-import httpx
+from app.schemas.loan import (LoanCreate, LoanReturn, LoanResponse, LoanDetailResponse, LoanHistoryResponse,
+                              OverdueLoansResponse, LoanBatchCreate, LoanBatchReturn, LoanBatchResponse)
+from app.clients import (get_user, get_user_detail, get_book_detail, get_user_details, reserve_book, release_book,
+                         reserve_books, release_books, ALL_COPIES_AVAILABLE)
+from app.catalog import catalog_join, local_book, book_details
+from app.concurrency import fan_out
+from app.stats import bump, read_counters, reconcile
+from app.responses import ORJSONResponse
+from app.pagination import encode_cursor, decode_cursor
+from app.export import export_response
+from app.tracing import span
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
-BOOK_SERVICE_URL = os.getenv("BOOK_SERVICE_URL")
+from typing import Optional
+import asyncio
 
 router = APIRouter()
 
-async def get_user(user_id: int):
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            url= f"{USER_SERVICE_URL}/api/users/{user_id}"
-            response = await client.get(url)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                raise HTTPException(status_code=404, detail="User not found")
-            raise HTTPException(status_code=503, detail="User Service unavailable")
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="User Service unavailable")
-
-async def get_book(book_id: int):
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            response = await client.get(f"{BOOK_SERVICE_URL}/api/books/{book_id}")
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                raise HTTPException(status_code=404, detail="Book not found")
-            raise HTTPException(status_code=503, detail="Book Service unavailable")
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="Book Service unavailable")
-
-async def update_book_availability(book_id: int, available_copies: int, operation: str):
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        try:
-            response = await client.patch(
-                f"{BOOK_SERVICE_URL}/api/books/{book_id}/availability",
-                json={"available_copies": available_copies, "operation": operation}
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=503, detail="Book Service unavailable")
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="Book Service unavailable")
+# Hot queries, kept as builders so benchmarks/explain_loans.py checks the exact statements served
+# (routes wrap them in catalog_join, and so does the check)
+
+def user_history_query(user_id: int):
+    return (
+        select(Loan.id, Loan.book_id, Loan.issue_date, Loan.due_date, Loan.return_date, Loan.status)
+        .filter(Loan.user_id == user_id)
+        .order_by(Loan.issue_date)
+    )
+
+def due_today_query(today: datetime):
+    # Half-open [today, tomorrow) range so (status, due_date) can be range-scanned
+    return (
+        select(func.count(Loan.id))
+        .filter(Loan.status == LoanStatus.ACTIVE, Loan.due_date >= today, Loan.due_date < today + timedelta(days=1))
+    )
+
+def active_users_query():
+    # Inline literal, not a bind parameter: the planner only matches the partial index
+    # ix_loans_active_user_id against the same constant predicate. DISTINCT in a subquery
+    # (rather than count(DISTINCT)) lets it walk that index in user_id order.
+    active = select(Loan.user_id).filter(Loan.status == literal_column("'ACTIVE'")).distinct().subquery()
+    return select(func.count()).select_from(active)
+
+def overdue_query(now: datetime, after: tuple | None = None, limit: int = 50):
+    # Range scan of (status, due_date) in index order; the cursor seeks past the last (due_date, id)
+    query = (
+        select(Loan.id, Loan.user_id, Loan.book_id, Loan.issue_date, Loan.due_date, Loan.return_date, Loan.status)
+        .filter(Loan.status == LoanStatus.ACTIVE, Loan.due_date < now)
+        .order_by(Loan.due_date, Loan.id)
+    )
+    if after:
+        query = query.filter(tuple_(Loan.due_date, Loan.id) > tuple_(*after))
+    return query.limit(limit)
 
 @router.post("/", response_model=LoanResponse, status_code=201)
-async def issue_book(loan: LoanCreate, db: Session = Depends(get_db)):
-    # Validate user
-    user = await get_user(loan.user_id)
-    # Validate book
-    book = await get_book(loan.book_id)
-    if book["available_copies"] <= 0:
-        raise HTTPException(status_code=400, detail="No available copies of the book")
-    # Update book availability
-    await update_book_availability(loan.book_id, book["available_copies"] - 1, "decrement")
+async def issue_book(loan: LoanCreate, db: AsyncSession = Depends(get_async_db)):
+    # Validate the user while BookService atomically takes one copy
+    user, book = await asyncio.gather(get_user(loan.user_id), reserve_book(loan.book_id), return_exceptions=True)
+    if isinstance(user, Exception):
+        if not isinstance(book, Exception):
+            await release_book(loan.book_id)
+        raise user
+    if isinstance(book, Exception):
+        raise book
     # Calculate due date (30 days from now)
     due_date = datetime.utcnow() + timedelta(days=30)
     # Create loan
     new_loan = Loan(user_id=loan.user_id, book_id=loan.book_id, due_date=due_date)
     db.add(new_loan)
-    db.commit()
-    db.refresh(new_loan)
+    try:
+        await bump(db, total_loans=1, active_loans=1)
+        with span("db COMMIT"):
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        await release_book(loan.book_id)
+        raise
+    await db.refresh(new_loan)
     return new_loan
 
 @router.post("/returns", response_model=LoanResponse)
-async def return_book(return_data: LoanReturn, db: Session = Depends(get_db)):
-    loan = db.query(Loan).filter(Loan.id == return_data.loan_id).first()
-    if not loan:
-        raise HTTPException(status_code=404, detail="Loan not found")
-    if loan.status == LoanStatus.RETURNED:
+async def return_book(return_data: LoanReturn, db: AsyncSession = Depends(get_async_db)):
+    # Claim the loan in one conditional UPDATE, so of several concurrent returns only one
+    # releases the copy and decrements the counter
+    loan = (await db.execute(
+        update(Loan)
+        .where(Loan.id == return_data.loan_id, Loan.status == LoanStatus.ACTIVE)
+        .values(status=LoanStatus.RETURNED, return_date=datetime.utcnow())
+        .returning(Loan)
+        .execution_options(synchronize_session=False)
+    )).scalars().first()
+    if loan is None:
+        await db.rollback()
+        if await db.get(Loan, return_data.loan_id) is None:
+            raise HTTPException(status_code=404, detail="Loan not found")
         raise HTTPException(status_code=400, detail="Loan already returned")
-    loan.status = LoanStatus.RETURNED
-    loan.return_date = datetime.utcnow()
-    book = await get_book(loan.book_id)
-    await update_book_availability(loan.book_id, book["available_copies"] + 1, "increment")
-    db.commit()
-    db.refresh(loan)
+    await bump(db, active_loans=-1)
+    with span("db COMMIT"):
+        await db.commit()
+    try:
+        await release_returned_copy(loan.book_id)
+    except Exception:
+        await unclaim(db, [loan.id])
+        raise
     return loan
 
+async def release_returned_copy(book_id: int):
+    """Give a returned loan's copy back to BookService.
+
+    A book with no copy out (its PUT reset available_copies to copies) already
+    counts this copy as available, so that refusal completes the return rather
+    than leaving a loan that can never be returned.
+    """
+    try:
+        await release_book(book_id)
+    except HTTPException as e:
+        if e.status_code != 400 or e.detail != ALL_COPIES_AVAILABLE:
+            raise
+
+async def unclaim(db: AsyncSession, loan_ids: list):
+    """Put claimed loans back to ACTIVE after BookService refused to release their copies."""
+    await db.execute(
+        update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.status == LoanStatus.RETURNED)
+        .values(status=LoanStatus.ACTIVE, return_date=None)
+        .execution_options(synchronize_session=False)
+    )
+    await bump(db, active_loans=len(loan_ids))
+    with span("db COMMIT"):
+        await db.commit()
+
+# A checkout desk handles a handful of books per patron
+MAX_LOAN_BATCH = 50
+
+def check_batch_size(ids: list):
+    if not 1 <= len(ids) <= MAX_LOAN_BATCH:
+        raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_LOAN_BATCH} items per batch")
+
+@router.post("/batch", response_model=LoanBatchResponse, status_code=201)
+async def issue_books(batch: LoanBatchCreate, db: AsyncSession = Depends(get_async_db)):
+    check_batch_size(batch.book_ids)
+    # One user lookup and one BookService call for the whole batch
+    user, reserved = await asyncio.gather(
+        get_user(batch.user_id), reserve_books(batch.book_ids), return_exceptions=True
+    )
+    reserved_ids = set() if isinstance(reserved, Exception) else {book["id"] for book in reserved["books"]}
+    book_ids = [book_id for book_id in batch.book_ids if book_id in reserved_ids]
+    if isinstance(user, Exception):
+        if book_ids:
+            await release_books(book_ids)
+        raise user
+    if isinstance(reserved, Exception):
+        raise reserved
+    due_date = datetime.utcnow() + timedelta(days=30)
+    loans = [Loan(user_id=batch.user_id, book_id=book_id, due_date=due_date) for book_id in book_ids]
+    db.add_all(loans)
+    try:
+        await bump(db, total_loans=len(loans), active_loans=len(loans))
+        with span("db COMMIT"):
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        if book_ids:
+            await release_books(book_ids)
+        raise
+    if loans:
+        # Reload once to pick up the server-side issue_date
+        loans = (await db.execute(
+            select(Loan).filter(Loan.id.in_([loan.id for loan in loans])).order_by(Loan.id)
+        )).scalars().all()
+    return {"loans": loans, "failed": reserved["failed"]}
+
+@router.post("/returns/batch", response_model=LoanBatchResponse)
+async def return_books(batch: LoanBatchReturn, db: AsyncSession = Depends(get_async_db)):
+    check_batch_size(batch.loan_ids)
+    loan_ids = list(dict.fromkeys(batch.loan_ids))
+    # Claim every still-active loan in one conditional UPDATE before any copy is released,
+    # so overlapping batches and single returns never release the same loan twice
+    claimed = (await db.execute(
+        update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.status == LoanStatus.ACTIVE)
+        .values(status=LoanStatus.RETURNED, return_date=datetime.utcnow())
+        .returning(Loan)
+        .execution_options(synchronize_session=False)
+    )).scalars().all()
+    claimed_ids = {loan.id for loan in claimed}
+    unclaimed = [loan_id for loan_id in loan_ids if loan_id not in claimed_ids]
+    existing = {}
+    if unclaimed:
+        existing = dict((await db.execute(select(Loan.id, Loan.book_id).filter(Loan.id.in_(unclaimed)))).all())
+    await bump(db, active_loans=-len(claimed))
+    with span("db COMMIT"):
+        await db.commit()
+    failed = [
+        {"loan_id": loan_id, "book_id": existing[loan_id], "status_code": 400, "detail": "Loan already returned"}
+        if loan_id in existing else {"loan_id": loan_id, "status_code": 404, "detail": "Loan not found"}
+        for loan_id in unclaimed
+    ]
+    if not claimed:
+        return {"loans": [], "failed": failed}
+    try:
+        released = await release_books([loan.book_id for loan in claimed])
+    except Exception:
+        await unclaim(db, list(claimed_ids))
+        raise
+    released_ids = {book["id"] for book in released["books"]}
+    release_failures = {failure["book_id"]: failure for failure in released["failed"]}
+    returned = [loan for loan in claimed if loan.book_id in released_ids]
+    refused = []
+    for loan in claimed:
+        if loan.book_id in released_ids:
+            continue
+        failure = release_failures[loan.book_id]
+        if failure["detail"] == ALL_COPIES_AVAILABLE:
+            # A batch moves all of a book's copies or none; release this loan's copy on its
+            # own, so a book with room for only some of them still returns those
+            try:
+                await release_returned_copy(loan.book_id)
+                returned.append(loan)
+                continue
+            except HTTPException as e:
+                failure = {"book_id": loan.book_id, "status_code": e.status_code, "detail": e.detail}
+        refused.append((loan, failure))
+    if refused:
+        await unclaim(db, [loan.id for loan, _ in refused])
+        failed.extend({"loan_id": loan.id, **failure} for loan, failure in refused)
+    return {"loans": sorted(returned, key=lambda loan: loan_ids.index(loan.id)), "failed": failed}
+
 @router.get("/user/{user_id}", response_model=LoanHistoryResponse)
-async def get_user_loans(user_id: int, db: Session = Depends(get_db)):
-    user = await get_user(user_id)
-    loans = db.query(Loan).filter(Loan.user_id == user_id).all()
+async def get_user_loans(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    # Fast path: plain column tuples encoded by orjson, no ORM objects or response_model pass
+    # Titles and authors come from the local catalog replica in the same query
+    rows = (await db.execute(catalog_join(user_history_query(user_id)))).all()
+    user, books = await fan_out(get_user_detail(user_id), book_details(rows))
+    user = user.dict()
     loan_details = []
-    for loan in loans:
-        book = await get_book(loan.book_id)
-        loan_details.append(LoanDetailResponse(
-            id=loan.id,
-            user=UserDetail(**user),
-            book=BookDetail(**book),
-            issue_date=loan.issue_date,
-            due_date=loan.due_date,
-            return_date=loan.return_date,
-            status=loan.status.value
-        ))
-    return {"loans": loan_details, "total": len(loan_details)}
+    for row in rows:
+        book = books.get(row.book_id)
+        if book is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        loan_details.append({
+            "id": row.id,
+            "user": user,
+            "book": book,
+            "issue_date": row.issue_date,
+            "due_date": row.due_date,
+            "return_date": row.return_date,
+            "status": row.status.value
+        })
+    return ORJSONResponse({"loans": loan_details, "total": len(loan_details)})
+
+MAX_OVERDUE_PAGE = 500
+
+@router.get("/overdue", response_model=OverdueLoansResponse)
+async def get_overdue_loans(limit: int = 50, after: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    if not 1 <= limit <= MAX_OVERDUE_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_OVERDUE_PAGE}")
+    cursor = None
+    if after:
+        due_date, loan_id = decode_cursor(after, 2)
+        try:
+            cursor = (datetime.fromisoformat(due_date), int(loan_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = (await db.execute(catalog_join(overdue_query(datetime.utcnow(), cursor, limit + 1)))).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].due_date.isoformat(), rows[-1].id)
+    # One batched, cache-aware user lookup for the whole page; books come from the replica
+    users, books = await fan_out(get_user_details(row.user_id for row in rows), book_details(rows))
+    users = {user_id: user.dict() for user_id, user in users.items()}
+    loans = []
+    for row in rows:
+        # A user or book deleted since the loan was issued drops the row instead of failing the page
+        if row.user_id not in users or row.book_id not in books:
+            continue
+        loans.append({
+            "id": row.id,
+            "user": users[row.user_id],
+            "book": books[row.book_id],
+            "issue_date": row.issue_date,
+            "due_date": row.due_date,
+            "return_date": row.return_date,
+            "status": row.status.value
+        })
+    return ORJSONResponse({"loans": loans, "next_cursor": next_cursor})
 
 @router.get("/stats")
-def get_loan_stats(db: Session = Depends(get_db)):
-    total_loans = db.query(Loan).count()
-    active_loans = db.query(Loan).filter(Loan.status == LoanStatus.ACTIVE).count()
-    due_today = db.query(Loan).filter(Loan.due_date == datetime.utcnow().date()).count()
+async def get_loan_stats(db: AsyncSession = Depends(get_async_db)):
+    counters = await read_counters(db)
+    total_loans = counters.get("total_loans", 0)
+    active_loans = counters.get("active_loans", 0)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    due_today = (await db.execute(due_today_query(today))).scalar()
     return {"total_loans": total_loans, "active_loans": active_loans, "due_today": due_today}
 
+@router.post("/stats/reconcile")
+async def reconcile_loan_stats(db: AsyncSession = Depends(get_async_db)):
+    return await reconcile(db)
+
 
 @router.get("/active-users")
-def get_active_users(db: Session = Depends(get_db)):
-    active_users = db.query(func.count(func.distinct(Loan.user_id))).filter(Loan.status == LoanStatus.ACTIVE).scalar() or 0
+async def get_active_users(db: AsyncSession = Depends(get_async_db)):
+    active_users = (await db.execute(active_users_query())).scalar() or 0
     return {"active_users": active_users}
 
 
 
+LOAN_COLUMNS = (Loan.id, Loan.user_id, Loan.book_id, Loan.issue_date, Loan.due_date, Loan.return_date, Loan.status)
+LOAN_FIELDS = tuple(column.key for column in LOAN_COLUMNS)
+
+@router.get("/export")
+async def export_loans(format: str = "ndjson", user_id: Optional[int] = None):
+    query = select(*LOAN_COLUMNS)
+    if user_id is not None:
+        # Full history of one user in issue order, walking ix_loans_user_id_issue_date
+        query = query.filter(Loan.user_id == user_id).order_by(Loan.issue_date, Loan.id)
+    else:
+        query = query.order_by(Loan.id)
+    return export_response(query, LOAN_FIELDS, format, f"loans-user-{user_id}" if user_id is not None else "loans")
+
 @router.get("/{id}", response_model=LoanDetailResponse)
-async def get_loan(id: int, db: Session = Depends(get_db)):
-    loan = db.query(Loan).filter(Loan.id == id).first()
-    if not loan:
+async def get_loan(id: int, db: AsyncSession = Depends(get_async_db)):
+    row = (await db.execute(catalog_join(select(Loan).filter(Loan.id == id)))).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Loan not found")
-    user = await get_user(loan.user_id)
-    book = await get_book(loan.book_id)
+    loan = row.Loan
+    book = local_book(loan.book_id, row)
+    if book is not None:
+        user = await get_user_detail(loan.user_id)
+    else:
+        user, book = await fan_out(get_user_detail(loan.user_id), get_book_detail(loan.book_id))
     return LoanDetailResponse(
         id=loan.id,
-        user=UserDetail(**user),
-        book=BookDetail(**book),
+        user=user,
+        book=book,
         issue_date=loan.issue_date,
         due_date=loan.due_date,
         return_date=loan.return_date,
@@ -0,0 +1,20 @@
+# Ordered schema changes applied once per database on startup, after create_all.
+# create_all only creates missing tables, so changes to existing tables go here.
+# Statements must work on both PostgreSQL and SQLite.
+MIGRATIONS = [
+    ("0001_loan_hot_query_indexes", [
+        # Active loans are a small slice of the table: serves active counts and distinct active users
+        "CREATE INDEX IF NOT EXISTS ix_loans_active_user_id ON loans (user_id) WHERE status = 'ACTIVE'",
+        # due_today and overdue scans: equality on status, range on due_date
+        "CREATE INDEX IF NOT EXISTS ix_loans_status_due_date ON loans (status, due_date)",
+        # Loan history of one user in issue order
+        "CREATE INDEX IF NOT EXISTS ix_loans_user_id_issue_date ON loans (user_id, issue_date)",
+    ]),
+    ("0002_stat_counter_shards", [
+        # Counters became (name, shard) rows; the old single-row table is derived data, so
+        # rebuild it empty and let ensure_counters recount on startup
+        "DROP TABLE IF EXISTS stat_counters",
+        "CREATE TABLE stat_counters (name VARCHAR NOT NULL, shard INTEGER NOT NULL, value BIGINT NOT NULL, "
+        "PRIMARY KEY (name, shard))",
+    ]),
+]
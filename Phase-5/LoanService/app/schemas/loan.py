@@ -42,4 +42,25 @@ class LoanDetailResponse(BaseModel):
 
 class LoanHistoryResponse(BaseModel):
     loans: List[LoanDetailResponse]
-    total: int
\ No newline at end of file
+    total: int
+
+class OverdueLoansResponse(BaseModel):
+    loans: List[LoanDetailResponse]
+    next_cursor: Optional[str] = None
+
+class LoanBatchCreate(BaseModel):
+    user_id: int
+    book_ids: List[int]
+
+class LoanBatchReturn(BaseModel):
+    loan_ids: List[int]
+
+class LoanBatchFailure(BaseModel):
+    loan_id: Optional[int] = None
+    book_id: Optional[int] = None
+    status_code: int
+    detail: str
+
+class LoanBatchResponse(BaseModel):
+    loans: List[LoanResponse]
+    failed: List[LoanBatchFailure]
\ No newline at end of file
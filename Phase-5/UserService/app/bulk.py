@@ -0,0 +1,147 @@
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_engine
+from app.models.user import User
+from app.schemas.user import UserCreate
+from app.stats import bump
+from dotenv import load_dotenv
+import orjson
+import os
+import time
+
+load_dotenv()
+# Users validated, upserted and committed together
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+
+async def _json_rows(request: Request):
+    try:
+        items = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of users")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array of users")
+    for item in items:
+        yield item
+
+
+async def _ndjson_rows(request: Request):
+    # One user per line, parsed as the body arrives so the upload is never held whole
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+async def _chunks(rows, size: int):
+    chunk = []
+    row = 0
+    async for item in rows:
+        row += 1
+        chunk.append((row, item))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse(item):
+    if isinstance(item, bytes):
+        try:
+            item = orjson.loads(item)
+        except orjson.JSONDecodeError:
+            raise ValueError("Invalid JSON")
+    if not isinstance(item, dict):
+        raise ValueError("Record must be an object")
+    try:
+        return UserCreate(**item)
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+
+
+def _upsert_statement():
+    if async_engine.dialect.name == "postgresql":
+        statement = postgresql_insert(User)
+        # xmax is 0 on a row version this statement inserted and set on one it updated
+        marker = literal_column("xmax = 0").label("inserted")
+    else:
+        statement = sqlite_insert(User)
+        # SQLite has no xmax; inserts leave updated_at NULL and the conflict branch always
+        # sets it. Returned as the bare column: SQLite 3.40 misevaluates "updated_at IS NULL"
+        # in an upsert's RETURNING
+        marker = User.updated_at
+    return statement.on_conflict_do_update(
+        index_elements=["email"],
+        set_={"name": statement.excluded.name, "role": statement.excluded.role, "updated_at": func.now()}
+    ).returning(User.id, User.email, marker)
+
+
+def _inserted(marker) -> bool:
+    return marker is True if async_engine.dialect.name == "postgresql" else marker is None
+
+
+async def bulk_upsert(request: Request, db: AsyncSession) -> dict:
+    """Create or update users from a JSON array or an NDJSON stream.
+
+    Emails are deduplicated across the whole upload (the first record wins),
+    then each chunk is upserted on email in one executemany and committed.
+    Every record gets an outcome: created, updated, duplicate or invalid.
+    """
+    if "ndjson" in request.headers.get("content-type", ""):
+        rows = _ndjson_rows(request)
+    else:
+        rows = _json_rows(request)
+    started = time.perf_counter()
+    statement = _upsert_statement()
+    seen_emails = set()
+    counts = {"created": 0, "updated": 0, "duplicate": 0, "invalid": 0}
+    results = []
+    async for chunk in _chunks(rows, BULK_CHUNK_SIZE):
+        users = {}
+        for row, item in chunk:
+            try:
+                user = _parse(item)
+            except ValueError as e:
+                results.append({"row": row, "email": None, "status": "invalid", "error": str(e)})
+                counts["invalid"] += 1
+                continue
+            if user.email in seen_emails:
+                results.append({"row": row, "email": user.email, "status": "duplicate"})
+                counts["duplicate"] += 1
+                continue
+            seen_emails.add(user.email)
+            users[user.email] = (row, user)
+        if not users:
+            continue
+        # Outcomes come from the upsert itself: a SELECT beforehand can miss rows other
+        # requests insert before the upsert runs
+        upserted = {email: (user_id, _inserted(marker)) for user_id, email, marker
+                    in await db.execute(statement, [user.dict() for _, user in users.values()])}
+        created = sum(1 for _, inserted in upserted.values() if inserted)
+        await bump(db, users=created)
+        await db.commit()
+        counts["created"] += created
+        counts["updated"] += len(upserted) - created
+        for email, (row, _) in users.items():
+            user_id, inserted = upserted[email]
+            results.append({"row": row, "email": email, "status": "created" if inserted else "updated", "id": user_id})
+    results.sort(key=lambda result: result["row"])
+    elapsed = time.perf_counter() - started
+    received = sum(counts.values())
+    return {
+        "received": received,
+        **counts,
+        "results": results,
+        "elapsed_seconds": round(elapsed, 3),
+        "users_per_second": round(received / elapsed, 1) if elapsed > 0 else None,
+    }
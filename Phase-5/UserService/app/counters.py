@@ -0,0 +1,7 @@
+from sqlalchemy import func, select
+from app.models.user import User
+
+# Each counter and the full-scan query that rebuilds it
+COUNTERS = {
+    "users": select(func.count(User.id)),
+}
@@ -0,0 +1,62 @@
+# Shared module: LoanService/app/export.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from app.database import AsyncSessionLocal
+from dotenv import load_dotenv
+from datetime import date, datetime
+from enum import Enum
+import csv
+import io
+import orjson
+import os
+
+load_dotenv()
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _encode_ndjson(rows, fields) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(fields, row))) + b"\n" for row in rows)
+
+
+def _encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue().encode()
+
+
+async def _stream_rows(query, fields, format: str):
+    # The export owns its session: a request-scoped one may be closed before the body is sent
+    async with AsyncSessionLocal() as db:
+        if format == "csv":
+            yield _encode_csv([fields])
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            # Each chunk is awaited by the ASGI server before the next batch is fetched,
+            # so a slow client throttles the cursor instead of growing a buffer
+            yield _encode_csv(rows) if format == "csv" else _encode_ndjson(rows, fields)
+
+
+def export_response(query, fields, format: str, filename: str) -> StreamingResponse:
+    """Stream the rows of `query` as NDJSON or CSV without materialising the result."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    return StreamingResponse(
+        _stream_rows(query, fields, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
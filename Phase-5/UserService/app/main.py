@@ -1,13 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routes import users
-from app.database import Base, engine
+from app.database import Base, engine, pool_stats
+from app.migrations import run_migrations
+from app.metrics import MetricsMiddleware, instrument_engines, metrics_response
+from app.tracing import TracingMiddleware, close_exporter, trace_engines
+from app.stats import ensure_counters, reconcile_periodically, STATS_RECONCILE_INTERVAL
+import asyncio
 
-Base.metadata.create_all(bind=engine)
+run_migrations(engine, Base.metadata)
+instrument_engines()
+trace_engines()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_counters()
+    reconciler = asyncio.create_task(reconcile_periodically()) if STATS_RECONCILE_INTERVAL > 0 else None
+    yield
+    if reconciler:
+        reconciler.cancel()
+    close_exporter()
 
 app = FastAPI(
             title="User Service",
-            root_path="/api/users"
+            root_path="/api/users",
+            lifespan=lifespan
             )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware, service="user-service")
+
+# Registered before the router so "/{id}" does not shadow them
+@app.get("/metrics")
+def get_metrics():
+    return metrics_response()
+
+@app.get("/db-pool-stats")
+def get_db_pool_stats():
+    return pool_stats()
+
 app.include_router(users.router)
 
 @app.get("/")
@@ -0,0 +1,13 @@
+# Shared module: LoanService/app/models/stat.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from sqlalchemy import Column, String, BigInteger, Integer
+from app.database import Base
+
+class StatCounter(Base):
+    __tablename__ = "stat_counters"
+
+    name = Column(String, primary_key=True)
+    # Each counter is spread over STATS_SHARDS rows; its value is their sum
+    shard = Column(Integer, primary_key=True, default=0)
+    value = Column(BigInteger, nullable=False, default=0)
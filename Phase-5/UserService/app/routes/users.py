@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.database import get_async_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserResponse
+from app.bulk import bulk_upsert
+from app.export import export_response
+from app.metrics import observe_downstream
+from app.tracing import span, trace_headers
+from app.stats import bump, read_counters, reconcile
+from typing import List
 import httpx
 from dotenv import load_dotenv
 import os
+import time
 
 load_dotenv()
 LOAN_SERVICE_URL = os.getenv("LOAN_SERVICE_URL")
@@ -13,48 +21,90 @@ LOAN_SERVICE_URL = os.getenv("LOAN_SERVICE_URL")
 router = APIRouter(tags=["Users"])
 
 @router.post("/", response_model=UserResponse, status_code=201)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(User).filter(User.email == user.email))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     new_user = User(**user.dict())
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await bump(db, users=1)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
+@router.post("/bulk")
+async def bulk_create_users(request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await bulk_upsert(request, db)
+
 @router.get("/stats", tags=["Users"])
-async def get_user_stats(db: Session = Depends(get_db)):
-    total_users = db.query(User).count()
+async def get_user_stats(db: AsyncSession = Depends(get_async_db)):
+    total_users = (await read_counters(db)).get("users", 0)
     # Fetch active users by querying Loan Service for users with active loans
     async with httpx.AsyncClient(timeout=5.0) as client:
+        started = time.perf_counter()
+        status = "error"
         try:
             # We'll need a new endpoint in Loan Service to get distinct users with active loans
-            response = await client.get(f"{LOAN_SERVICE_URL}/api/loans/active-users")
+            with span("loan GET /api/loans/active-users", "client", **{"peer.service": "loan"}) as client_span:
+                response = await client.get(f"{LOAN_SERVICE_URL}/api/loans/active-users",
+                                            headers=trace_headers(client_span))
+            status = response.status_code
             response.raise_for_status()
             active_users = response.json().get("active_users", 0)
         except (httpx.HTTPStatusError, httpx.RequestError):
             # If Loan Service is unavailable, return 0 for active_users
             active_users = 0
+        finally:
+            observe_downstream("loan", "GET", status, time.perf_counter() - started)
     return {"users": total_users, "active_users": active_users}
 
+@router.post("/stats/reconcile", tags=["Users"])
+async def reconcile_user_stats(db: AsyncSession = Depends(get_async_db)):
+    return await reconcile(db)
+
+
+
+MAX_BATCH_IDS = 500
+
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
+
+@router.get("/batch", response_model=List[UserResponse])
+async def get_users_batch(ids: str, db: AsyncSession = Depends(get_async_db)):
+    user_ids = parse_ids(ids)
+    if not user_ids:
+        return []
+    return (await db.execute(select(User).filter(User.id.in_(user_ids)))).scalars().all()
+
+# Columns of UserResponse, streamed as plain tuples by the export
+USER_COLUMNS = (User.id, User.name, User.email, User.role, User.created_at, User.updated_at)
+USER_FIELDS = tuple(column.key for column in USER_COLUMNS)
 
+@router.get("/export")
+async def export_users(format: str = "ndjson"):
+    return export_response(select(*USER_COLUMNS).order_by(User.id), USER_FIELDS, format, "users")
 
 @router.get("/{id}", response_model=UserResponse)
-def get_user(id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == id).first()
+async def get_user(id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.put("/{id}", response_model=UserResponse)
-def update_user(id: int, user_update: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == id).first()
+async def update_user(id: int, user_update: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(User, id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     for key, value in user_update.dict().items():
         setattr(db_user, key, value)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
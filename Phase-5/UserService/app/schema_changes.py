@@ -0,0 +1,12 @@
+# Ordered schema changes applied once per database on startup, after create_all.
+# create_all only creates missing tables, so changes to existing tables go here.
+# Statements must work on both PostgreSQL and SQLite.
+MIGRATIONS = [
+    ("0001_stat_counter_shards", [
+        # Counters became (name, shard) rows; the old single-row table is derived data, so
+        # rebuild it empty and let ensure_counters recount on startup
+        "DROP TABLE IF EXISTS stat_counters",
+        "CREATE TABLE stat_counters (name VARCHAR NOT NULL, shard INTEGER NOT NULL, value BIGINT NOT NULL, "
+        "PRIMARY KEY (name, shard))",
+    ]),
+]
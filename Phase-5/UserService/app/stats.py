@@ -0,0 +1,86 @@
+# Shared module: LoanService/app/stats.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, async_engine
+from app.models.stat import StatCounter
+from app.counters import COUNTERS
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import random
+
+load_dotenv()
+# Seconds between background reconciles; 0 disables the schedule
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "0"))
+# Rows per counter; each bump updates one at random so concurrent writers rarely wait on the same row lock
+STATS_SHARDS = max(int(os.getenv("STATS_SHARDS", "8")), 1)
+
+logger = logging.getLogger(__name__)
+
+def _insert():
+    return postgresql_insert if async_engine.dialect.name == "postgresql" else sqlite_insert
+
+async def bump(db: AsyncSession, **deltas):
+    """Adjust counters inside the caller's transaction; commit with the write they describe."""
+    shard = random.randrange(STATS_SHARDS)
+    for name, delta in deltas.items():
+        if delta:
+            await db.execute(
+                update(StatCounter)
+                .where(StatCounter.name == name, StatCounter.shard == shard)
+                .values(value=StatCounter.value + delta)
+            )
+
+async def read_counters(db: AsyncSession) -> dict:
+    rows = await db.execute(select(StatCounter.name, func.sum(StatCounter.value)).group_by(StatCounter.name))
+    return {name: int(value) for name, value in rows}
+
+async def reconcile(db: AsyncSession) -> dict:
+    # Lock the counters first so concurrent bumps wait for the rebuilt values
+    await db.execute(select(StatCounter.name).with_for_update())
+    values = {}
+    for name, query in COUNTERS.items():
+        values[name] = (await db.execute(query)).scalar() or 0
+    # The full value goes to shard 0 and every other shard restarts from zero
+    statement = _insert()(StatCounter).values([
+        {"name": name, "shard": shard, "value": values[name] if shard == 0 else 0}
+        for name in COUNTERS for shard in range(STATS_SHARDS)
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=["name", "shard"], set_={"value": statement.excluded.value}
+    ))
+    # Shards left over from a larger STATS_SHARDS are still summed on read
+    await db.execute(update(StatCounter).where(StatCounter.shard >= STATS_SHARDS).values(value=0))
+    await db.commit()
+    return values
+
+async def ensure_counters():
+    """Create missing counter shards, and rebuild the counters if any were missing.
+
+    Several workers may start at once; ON CONFLICT DO NOTHING lets exactly one
+    of them create each row instead of racing on a read-then-insert.
+    """
+    statement = _insert()(StatCounter).values([
+        {"name": name, "shard": shard, "value": 0} for name in COUNTERS for shard in range(STATS_SHARDS)
+    ])
+    async with AsyncSessionLocal() as db:
+        created = (await db.execute(
+            statement.on_conflict_do_nothing(index_elements=["name", "shard"]).returning(StatCounter.name)
+        )).all()
+        await db.commit()
+        if created:
+            await reconcile(db)
+
+async def reconcile_periodically():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                await reconcile(db)
+        except Exception:
+            logger.exception("Stats reconcile failed")
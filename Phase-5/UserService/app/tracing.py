@@ -0,0 +1,303 @@
+# Shared module: LoanService/app/tracing.py is the canonical copy and BookService and UserService
+# carry identical ones. Edit it there and copy it over; benchmarks/test_shared_modules.py
+# fails when the copies differ.
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.database import engine, async_engine
+from dotenv import load_dotenv
+import orjson
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+load_dotenv()
+# Finished spans are appended here as JSON lines (e.g. TRACE_FILE=traces.jsonl);
+# empty, the default, disables the exporter
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Size at which the file is moved to TRACE_FILE.1 (replacing the previous one) and
+# a new one started, so at most about twice this is kept; 0 never rotates
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(100 * 1024 * 1024)))
+# Fraction of new traces recorded; continued traces follow the caller's decision
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+# W3C trace context: version-trace_id-parent_id-flags
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class JsonlExporter:
+    """Appends spans as JSON lines from a background thread, so the event loop
+    never waits on the disk. Each batch goes out in one O_APPEND write, so lines
+    from several worker processes sharing the file never interleave."""
+
+    # Bytes this process writes between checks of the file's size
+    CHECK_EVERY = 64 * 1024
+    # Spans waiting for the writer thread; more than this are dropped, not buffered
+    MAX_PENDING = 10000
+    MAX_BATCH = 512
+
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fd = None
+        self.unchecked = 0
+        self.pending = queue.Queue(self.MAX_PENDING)
+        self.thread = None
+        self.dropped = 0
+
+    def export(self, span: dict):
+        if not self.path:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self.thread.start()
+        try:
+            self.pending.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            # None is close()'s signal to flush and stop
+            lines = b"".join(orjson.dumps(span) + b"\n" for span in batch if span is not None)
+            if lines:
+                self._write(lines)
+            if None in batch:
+                self._close_file()
+                return
+
+    def _write(self, lines: bytes):
+        if self.fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self.fd, lines)
+        self.unchecked += len(lines)
+        if self.max_bytes and self.unchecked >= min(self.CHECK_EVERY, self.max_bytes):
+            self.unchecked = 0
+            self._rotate()
+
+    def _rotate(self):
+        opened = os.fstat(self.fd)
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is not None and current.st_ino == opened.st_ino:
+            if opened.st_size < self.max_bytes:
+                return
+            os.replace(self.path, self.path + ".1")
+        # Rotated by us or by another worker sharing the file: continue in a fresh one
+        self._close_file()
+
+    def _close_file(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def close(self):
+        """Write out every span exported so far and stop the writer thread."""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+exporter = JsonlExporter(TRACE_FILE)
+# With the exporter off no span is ever built; requests only carry the caller's context along
+TRACING_ENABLED = bool(TRACE_FILE)
+service_name = "unknown"
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "request_id", "sampled",
+                 "attributes", "error", "start", "started")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: str | None, request_id: str,
+                 sampled: bool, attributes: dict):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.request_id = request_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.started = time.perf_counter()
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def finish(self):
+        if not self.sampled:
+            return
+        exporter.export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "request_id": self.request_id,
+            "service": service_name,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        })
+
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+# (traceparent or None, request id) of the request being served while tracing is off
+passthrough_context: ContextVar[tuple | None] = ContextVar("passthrough_context", default=None)
+
+
+def start_span(name: str, kind: str = "internal", **attributes) -> Span | None:
+    """Start a child of the current span; None when no trace is active or it is not sampled."""
+    parent = current_span.get()
+    if parent is None or not parent.sampled:
+        return None
+    return Span(name, kind, parent.trace_id, parent.span_id, parent.request_id, parent.sampled, attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    child = start_span(name, kind, **attributes)
+    if child is None:
+        yield None
+        return
+    token = current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.error = repr(e)
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+
+def trace_headers(client_span: Span | None = None) -> dict:
+    """Headers that let the next service continue the current trace."""
+    active = client_span or current_span.get()
+    if active is None:
+        context = passthrough_context.get()
+        if context is None:
+            return {}
+        traceparent, request_id = context
+        return {"traceparent": traceparent, "x-request-id": request_id} if traceparent else {"x-request-id": request_id}
+    return {"traceparent": active.traceparent(), "x-request-id": active.request_id}
+
+
+def trace_engine(sync_engine, name: str):
+    # One span per statement, so a waterfall shows each query next to the HTTP calls
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = current_span.get()
+        child = None
+        if parent is not None and parent.sampled:
+            child = start_span(f"db {statement.split(None, 1)[0].upper()}", "client", engine=name,
+                               statement=statement[:500])
+        conn.info.setdefault("trace_spans", []).append(child)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        child = conn.info["trace_spans"].pop()
+        if child is not None:
+            child.finish()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            child = spans.pop()
+            if child is not None:
+                child.error = repr(context.original_exception)
+                child.finish()
+
+
+def trace_engines():
+    if not TRACING_ENABLED:
+        return
+    trace_engine(engine, "sync")
+    trace_engine(async_engine.sync_engine, "async")
+
+
+class TracingMiddleware:
+    """Opens the server span for each request, continuing the caller's trace when
+    a traceparent header is present, and echoes the request id back."""
+
+    def __init__(self, app, service: str):
+        global service_name
+        service_name = service
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        match = TRACEPARENT_RE.match(headers.get("traceparent", ""))
+        if not TRACING_ENABLED:
+            return await self._pass_through(scope, receive, send, headers, match)
+        if match:
+            trace_id, parent_id, sampled = match.group(1), match.group(2), match.group(3) == "01"
+        else:
+            trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < TRACE_SAMPLE_RATE
+        request_id = headers.get("x-request-id") or trace_id
+        server_span = Span(f"{scope['method']} {scope['path']}", "server", trace_id, parent_id, request_id, sampled,
+                           {"http.method": scope["method"], "http.target": scope["path"]})
+        token = current_span.set(server_span)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                server_span.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        except Exception as e:
+            server_span.error = repr(e)
+            raise
+        finally:
+            current_span.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                server_span.name = f"{scope['method']} {route.path}"
+                server_span.attributes["http.route"] = route.path
+            server_span.finish()
+
+
+    async def _pass_through(self, scope, receive, send, headers: dict, match):
+        """Serve without spans, still forwarding the caller's trace context and echoing a request id."""
+        request_id = headers.get("x-request-id") or (match.group(1) if match else os.urandom(16).hex())
+        token = passthrough_context.set((match.group(0) if match else None, request_id))
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            passthrough_context.reset(token)
+
+
+def close_exporter():
+    exporter.close()
@@ -0,0 +1,99 @@
+"""Throughput of an async handler using the sync Session vs. an AsyncSession.
+
+Every request runs one deliberately slow query. With the sync Session the
+query blocks the event loop, so requests are served one at a time; with the
+AsyncSession they overlap up to the connection pool size.
+
+    python benchmarks/async_db.py --requests 200 --concurrency 50 --delay 0.05
+
+Uses DATABASE_URL when set (pg_sleep on PostgreSQL), otherwise a temporary
+SQLite file with a sleep() function registered on each connection.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def build_app(database_url: str, delay: float) -> FastAPI:
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    async_url = url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+    engine = create_engine(database_url)
+    async_engine = create_async_engine(async_url, pool_size=20, max_overflow=0)
+
+    if backend == "sqlite":
+        def add_sleep(dbapi_connection, connection_record):
+            dbapi_connection.create_function("sleep", 1, lambda seconds: time.sleep(seconds) or 0)
+
+        event.listen(engine, "connect", add_sleep)
+        event.listen(async_engine.sync_engine, "connect", add_sleep)
+        slow_query = text("SELECT sleep(:delay)")
+    else:
+        slow_query = text("SELECT pg_sleep(:delay)")
+
+    SessionLocal = sessionmaker(bind=engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine)
+
+    app = FastAPI()
+
+    # Sessions are opened inside the handlers so each request gives its
+    # connection back as soon as the query is done. With a Depends(get_db)
+    # session the blocked loop never runs the teardown that returns it, and
+    # concurrency above the pool size deadlocks until the pool timeout.
+    @app.get("/sync-session")
+    async def sync_session():
+        with SessionLocal() as db:
+            db.execute(slow_query, {"delay": delay})
+        return {"ok": True}
+
+    @app.get("/async-session")
+    async def async_session():
+        async with AsyncSessionLocal() as db:
+            await db.execute(slow_query, {"delay": delay})
+        return {"ok": True}
+
+    return app
+
+
+async def run(app: FastAPI, path: str, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(path)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+    return {"path": path, "requests": requests, "seconds": round(elapsed, 3), "req_per_s": round(requests / elapsed, 1)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds each query sleeps")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app = build_app(database_url, args.delay)
+    for path in ("/sync-session", "/async-session"):
+        print(await run(app, path, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""EXPLAIN-based regression check for LoanService's hot queries.
+
+Builds the loans schema plus migrations in a scratch database (or the one in
+DATABASE_URL), runs EXPLAIN on the statements the routes execute (including
+the catalog replica join), and fails if any of them stops using its index or
+falls back to a full scan of loans or catalog_books.
+
+    python benchmarks/explain_loans.py
+    python -m pytest benchmarks/test_explain_loans.py
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'explain.db')}")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "LoanService"))
+
+from sqlalchemy import select, text  # noqa: E402
+from sqlalchemy.ext.compiler import compiles  # noqa: E402
+from sqlalchemy.sql.expression import ClauseElement, Executable  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+from app.models.loan import Loan, LoanStatus  # noqa: E402
+from app.catalog import catalog_join  # noqa: E402
+from app.routes.loans import active_users_query, due_today_query, overdue_query, user_history_query  # noqa: E402
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    prefix = "EXPLAIN QUERY PLAN " if compiler.dialect.name == "sqlite" else "EXPLAIN "
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def seed(conn, count: int = 2000):
+    now = datetime.utcnow()
+    conn.execute(Loan.__table__.insert(), [
+        {
+            "user_id": i % 200,
+            "book_id": i % 500,
+            "issue_date": now - timedelta(days=i % 90),
+            "due_date": now + timedelta(days=30 - i % 90),
+            "status": LoanStatus.ACTIVE if i % 10 == 0 else LoanStatus.RETURNED,
+        }
+        for i in range(count)
+    ])
+
+
+# (name, statement exactly as the route builds it, index names any of which the plan must use)
+CHECKS = [
+    ("active users", active_users_query(), ("ix_loans_active_user_id",)),
+    ("due today", due_today_query(datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)),
+     ("ix_loans_status_due_date",)),
+    ("user history", catalog_join(user_history_query(7)), ("ix_loans_user_id_issue_date",)),
+    ("overdue page", catalog_join(overdue_query(datetime(2024, 1, 15))), ("ix_loans_status_due_date",)),
+    ("loan detail", catalog_join(select(Loan).filter(Loan.id == 7)), ("PRIMARY KEY", "loans_pkey")),
+]
+
+# A table read row by row: "SCAN loans" without USING in SQLite, "Seq Scan on loans" in PostgreSQL
+FULL_SCAN_RE = re.compile(r"^SCAN (loans|catalog_books)\s*$|Seq Scan on (loans|catalog_books)\b", re.MULTILINE)
+
+
+def prepare(conn):
+    if not conn.execute(text("SELECT 1 FROM loans LIMIT 1")).first():
+        seed(conn)
+    if engine.dialect.name == "postgresql":
+        conn.execute(text("ANALYZE loans"))
+        # Small tables make a seq scan cheapest; we only care that the index is usable
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+    else:
+        conn.execute(text("ANALYZE"))
+
+
+def explain(conn, statement) -> str:
+    # SQLite rows are (id, parent, notused, detail); keep only the detail so FULL_SCAN_RE can anchor on it
+    rows = conn.execute(Explain(statement))
+    if engine.dialect.name == "sqlite":
+        return "\n".join(str(row[-1]) for row in rows)
+    return "\n".join(" ".join(str(col) for col in row) for row in rows)
+
+
+def check(plan: str, indexes) -> list:
+    problems = []
+    if not any(index in plan for index in indexes):
+        problems.append(f"expected one of {', '.join(indexes)}")
+    scan = FULL_SCAN_RE.search(plan)
+    if scan:
+        problems.append(f"full scan: {scan.group(0).strip()}")
+    return problems
+
+
+def main():
+    run_migrations(engine, Base.metadata)
+    failures = 0
+    with engine.begin() as conn:
+        prepare(conn)
+        for name, statement, indexes in CHECKS:
+            plan = explain(conn, statement)
+            problems = check(plan, indexes)
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok  '} {name}: {'; '.join(problems) or 'uses ' + ' / '.join(indexes)}"
+                  f"\n{plan}\n")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
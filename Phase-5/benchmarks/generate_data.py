@@ -0,0 +1,359 @@
+"""Fill the users, books and loans databases with a large synthetic library.
+
+    python benchmarks/generate_data.py --users 200000 --books 1000000 --loans 20000000 \\
+        --user-db postgresql://postgres:pw@localhost/user_db \\
+        --book-db postgresql://postgres:pw@localhost/book_db \\
+        --loan-db postgresql://postgres:pw@localhost/loan_db --workers 8 --reset
+
+Each service's own models (and LoanService's migrations) create the schema.
+Distributions:
+  * book popularity and borrower activity are Zipfian (--book-skew, --user-skew)
+  * issue dates follow the academic year: semester peaks, quiet summers and
+    holidays, fewer loans at weekends, most during opening hours
+  * --active-fraction of the loans are still out; --overdue-fraction of those
+    are past their due date, and no book has more loans out than copies
+
+Rows are streamed in batches through COPY on PostgreSQL (historical loans in
+--workers parallel processes) and executemany with journaling relaxed on
+SQLite. Secondary indexes are dropped for the load and rebuilt afterwards.
+Stat counters are cleared, so each service rebuilds them on its next start.
+"""
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine  # noqa: E402
+from services import SERVICES, load_service  # noqa: E402
+
+BATCH_SIZE = 100_000
+LOAN_PERIOD = timedelta(days=30)
+
+FIRST_NAMES = ["Amina", "Ben", "Chloe", "Dmitri", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas", "Kemi",
+               "Liam", "Maya", "Noah", "Olga", "Priya", "Quinn", "Rafael", "Sara", "Tomas", "Uma", "Viktor"]
+LAST_NAMES = ["Ahmed", "Brown", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Hassan", "Ito", "Jensen",
+              "Kowalski", "Lopez", "Muller", "Nguyen", "Okafor", "Patel", "Rossi", "Silva", "Tanaka", "Weber"]
+TITLE_WORDS = ["History", "Science", "Garden", "River", "Night", "Code", "Ocean", "Stone", "War", "Love", "Light",
+               "City", "Empire", "Winter", "Machine", "Song", "Road", "Glass", "Theory", "Silent", "Lost", "Modern",
+               "Introduction", "Principles", "Data", "Art", "Mind", "Economy", "Earth", "Voices"]
+# Relative loan volume by month (semester peaks in Feb-Apr and Sep-Nov) and weekday (Mon..Sun)
+MONTH_WEIGHTS = [0.8, 1.2, 1.25, 1.1, 0.9, 0.5, 0.35, 0.6, 1.35, 1.3, 1.15, 0.55]
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 0.95, 0.85, 0.5, 0.35]
+HOUR_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 0.2, 0.6, 1.0, 1.2, 1.2, 1.1, 1.2, 1.3, 1.3, 1.1, 0.9, 0.6, 0.4, 0.3, 0.1, 0, 0]
+
+
+def zipf_cum_weights(count: int, skew: float) -> list:
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class LoanSampler:
+    """Draws (user_id, book_id, issue_date) triples from the configured distributions."""
+
+    def __init__(self, user_ids, book_ids, user_skew: float, book_skew: float, years: float, now: datetime,
+                 seed: int, rank_seed: int):
+        self.rng = random.Random(seed)
+        # Popularity rank -> id, shuffled so popular books are spread over the id range. Every
+        # worker shuffles with the same rank_seed, so they agree on which books are popular.
+        self.users = list(user_ids)
+        self.books = list(book_ids)
+        random.Random(rank_seed).shuffle(self.users)
+        random.Random(rank_seed + 1).shuffle(self.books)
+        self.user_weights = zipf_cum_weights(len(self.users), user_skew)
+        self.book_weights = zipf_cum_weights(len(self.books), book_skew)
+        self.now = now
+        first_day = (now - timedelta(days=int(years * 365))).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.days = [first_day + timedelta(days=i) for i in range((now - first_day).days)]
+        self.day_weights = list(accumulate(
+            MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()] for day in self.days
+        ))
+        self.hour_weights = list(accumulate(HOUR_WEIGHTS))
+
+    def users_and_books(self, k: int):
+        return (self.rng.choices(self.users, cum_weights=self.user_weights, k=k),
+                self.rng.choices(self.books, cum_weights=self.book_weights, k=k))
+
+    def issue_dates(self, k: int):
+        days = self.rng.choices(self.days, cum_weights=self.day_weights, k=k)
+        hours = self.rng.choices(range(24), cum_weights=self.hour_weights, k=k)
+        return [day + timedelta(hours=hour, seconds=self.rng.randrange(3600)) for day, hour in zip(days, hours)]
+
+    def return_delay(self) -> timedelta:
+        # Most books come back within two or three weeks, a tail well after the due date
+        return timedelta(days=min(self.rng.expovariate(1 / 14), 120), seconds=self.rng.randrange(86400))
+
+
+def format_datetime(value: datetime) -> str:
+    # Same text SQLAlchemy stores for SQLite DateTime columns; isoformat is ~3x faster than strftime
+    return value.isoformat(" ", "microseconds")
+
+
+class Loader:
+    """Bulk writer for one database: COPY on PostgreSQL, executemany on SQLite."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(url)
+        self.dialect = self.engine.dialect.name
+        self.connection = self.engine.raw_connection()
+        if self.dialect == "sqlite":
+            cursor = self.connection.cursor()
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.execute("PRAGMA journal_mode=MEMORY")
+            cursor.close()
+
+    def scalar(self, statement: str):
+        cursor = self.connection.cursor()
+        cursor.execute(statement)
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
+
+    def execute(self, *statements: str):
+        cursor = self.connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        self.connection.commit()
+        cursor.close()
+
+    def reset(self, table: str):
+        if self.dialect == "postgresql":
+            self.execute(f"TRUNCATE {table} RESTART IDENTITY")
+        else:
+            # Integer primary keys restart at 1 once the table is empty (no AUTOINCREMENT)
+            self.execute(f"DELETE FROM {table}")
+
+    def drop_indexes(self, table: str) -> list:
+        """Drop secondary indexes on table and return the DDL that rebuilds them."""
+        cursor = self.connection.cursor()
+        if self.dialect == "postgresql":
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+                "AND indexname NOT IN (SELECT conname FROM pg_constraint)", (table,)
+            )
+        else:
+            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                           "AND sql IS NOT NULL", (table,))
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+        self.connection.commit()
+        cursor.close()
+        return [ddl for _, ddl in indexes]
+
+    def create_indexes(self, statements: list):
+        cursor = self.connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("ANALYZE")
+        self.connection.commit()
+        cursor.close()
+
+    def write(self, table: str, columns: tuple, rows: list):
+        cursor = self.connection.cursor()
+        if self.dialect == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            placeholders = ", ".join("?" for _ in columns)
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        self.connection.commit()
+        cursor.close()
+
+    def ids(self, table: str) -> list:
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT id FROM {table} ORDER BY id")
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return ids
+
+    def close(self):
+        self.connection.close()
+        self.engine.dispose()
+
+
+def stage(label: str, rows: int, started: float):
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {rows:>12,} rows {elapsed:>8.1f} s {rows / max(elapsed, 1e-9):>12,.0f} rows/s", flush=True)
+
+
+def generate_users(loader: Loader, count: int, rng: random.Random):
+    columns = ("name", "email", "role", "created_at")
+    created = format_datetime(datetime.utcnow())
+    for start in range(0, count, BATCH_SIZE):
+        loader.write("users", columns, [
+            (f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"user{i}@library.example",
+             "student" if rng.random() < 0.95 else "staff", created)
+            for i in range(start, min(start + BATCH_SIZE, count))
+        ])
+
+
+def generate_books(loader: Loader, copies: list, rng: random.Random):
+    columns = ("title", "author", "isbn", "copies", "available_copies", "created_at")
+    created = format_datetime(datetime.utcnow())
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(max(len(copies) // 8, 1))]
+    for start in range(0, len(copies), BATCH_SIZE):
+        loader.write("books", columns, [
+            (" ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4))), rng.choice(authors), f"979{i:010d}",
+             total, available, created)
+            for i, (total, available) in enumerate(copies[start:start + BATCH_SIZE], start)
+        ])
+
+
+def plan_active_loans(sampler: LoanSampler, count: int, overdue_fraction: float, copies: dict) -> list:
+    """Loans still out, never more per book than it has copies."""
+    rng = sampler.rng
+    out = {}
+    loans = []
+    attempts = 0
+    while len(loans) < count and attempts < count * 20:
+        attempts += 1
+        (user_id,), (book_id,) = sampler.users_and_books(1)
+        if out.get(book_id, 0) >= copies[book_id]:
+            continue
+        out[book_id] = out.get(book_id, 0) + 1
+        if rng.random() < overdue_fraction:
+            issued = sampler.now - LOAN_PERIOD - timedelta(days=rng.uniform(1, 90))
+        else:
+            issued = sampler.now - timedelta(days=rng.uniform(0, 29.9))
+        loans.append((user_id, book_id, format_datetime(issued), format_datetime(issued + LOAN_PERIOD), None,
+                      "ACTIVE"))
+    return loans
+
+
+LOAN_COLUMNS = ("user_id", "book_id", "issue_date", "due_date", "return_date", "status")
+# Set in the parent before forking the loan workers
+_sampler_args = None
+
+
+def returned_loans(sampler: LoanSampler, count: int):
+    """Historical, already returned loans in batches."""
+    for start in range(0, count, BATCH_SIZE):
+        k = min(BATCH_SIZE, count - start)
+        users, books = sampler.users_and_books(k)
+        rows = []
+        for user_id, book_id, issued in zip(users, books, sampler.issue_dates(k)):
+            returned = min(issued + sampler.return_delay(), sampler.now)
+            rows.append((user_id, book_id, format_datetime(issued), format_datetime(issued + LOAN_PERIOD),
+                         format_datetime(returned), "RETURNED"))
+        yield rows
+
+
+def load_returned_loans(worker: int, count: int, url: str) -> int:
+    user_ids, book_ids, options = _sampler_args
+    sampler = LoanSampler(user_ids, book_ids, seed=options["rank_seed"] + worker + 1, **options)
+    loader = Loader(url)
+    for rows in returned_loans(sampler, count):
+        loader.write("loans", LOAN_COLUMNS, rows)
+    loader.close()
+    return count
+
+
+def main():
+    global _sampler_args
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--loans", type=int, default=1_000_000)
+    parser.add_argument("--max-copies", type=int, default=8)
+    parser.add_argument("--years", type=float, default=3, help="span of loan history")
+    parser.add_argument("--book-skew", type=float, default=1.05, help="Zipf exponent of book popularity")
+    parser.add_argument("--user-skew", type=float, default=0.8, help="Zipf exponent of borrower activity")
+    parser.add_argument("--active-fraction", type=float, default=0.02, help="share of loans still out")
+    parser.add_argument("--overdue-fraction", type=float, default=0.15, help="share of active loans past due")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="parallel loan writers (PostgreSQL only)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--user-db", default="sqlite:///users.db")
+    parser.add_argument("--book-db", default="sqlite:///books.db")
+    parser.add_argument("--loan-db", default="sqlite:///loans.db")
+    parser.add_argument("--reset", action="store_true", help="empty the tables first")
+    args = parser.parse_args()
+
+    urls = {"users": args.user_db, "books": args.book_db, "loans": args.loan_db}
+    env = {"TRACE_FILE": "", "SEARCH_BACKEND": "memory"}
+    # Importing each service's app.main creates its schema and applies LoanService's migrations
+    for key, service in SERVICES.items():
+        load_service(service, urls[key], env)
+
+    loaders = {key: Loader(url) for key, url in urls.items()}
+    tables = {"users": "users", "books": "books", "loans": "loans"}
+    for key, table in tables.items():
+        if args.reset:
+            loaders[key].reset(table)
+        elif loaders[key].scalar(f"SELECT count(*) FROM {table}"):
+            raise SystemExit(f"{table} is not empty; pass --reset to replace its rows")
+    if args.reset:
+        # Change events of the replaced books
+        loaders["books"].reset("book_events")
+    indexes = {key: loaders[key].drop_indexes(table) for key, table in tables.items()}
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    generate_users(loaders["users"], args.users, rng)
+    stage("users", args.users, t)
+
+    # Copies are drawn up front so active loans can be capped per book before the books are written
+    copies = [min(int(rng.expovariate(1 / 2)) + 1, args.max_copies) for _ in range(args.books)]
+    user_ids = loaders["users"].ids("users")
+    book_ids = list(range(1, args.books + 1))
+    options = {"user_skew": args.user_skew, "book_skew": args.book_skew, "years": args.years, "now": now,
+               "rank_seed": args.seed}
+    sampler = LoanSampler(user_ids, book_ids, seed=args.seed, **options)
+    active = plan_active_loans(sampler, int(args.loans * args.active_fraction), args.overdue_fraction,
+                               dict(zip(book_ids, copies)))
+    out = {}
+    for loan in active:
+        out[loan[1]] = out.get(loan[1], 0) + 1
+
+    t = time.perf_counter()
+    generate_books(loaders["books"], [(total, total - out.get(i + 1, 0)) for i, total in enumerate(copies)], rng)
+    if loaders["books"].scalar("SELECT max(id) FROM books") != args.books:
+        raise SystemExit("books did not get ids 1..N; run with --reset on an empty database")
+    stage("books", args.books, t)
+
+    t = time.perf_counter()
+    for start in range(0, len(active), BATCH_SIZE):
+        loaders["loans"].write("loans", LOAN_COLUMNS, active[start:start + BATCH_SIZE])
+    stage("active loans", len(active), t)
+
+    t = time.perf_counter()
+    remaining = args.loans - len(active)
+    workers = args.workers if loaders["loans"].dialect == "postgresql" else 1
+    shares = [remaining // workers + (1 if i < remaining % workers else 0) for i in range(workers)]
+    _sampler_args = (user_ids, book_ids, options)
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            pool.starmap(load_returned_loans, [(i, share, urls["loans"]) for i, share in enumerate(shares)])
+    else:
+        for rows in returned_loans(sampler, remaining):
+            loaders["loans"].write("loans", LOAN_COLUMNS, rows)
+    stage("returned loans", remaining, t)
+
+    t = time.perf_counter()
+    # Books are written without change events; LoanService re-copies its catalog replica on its next start
+    loaders["loans"].execute("DELETE FROM catalog_books", "DELETE FROM feed_offsets")
+    for key in tables:
+        loaders[key].create_indexes(indexes[key])
+        # Emptied counters are rebuilt by each service's ensure_counters on its next start
+        loaders[key].execute("DELETE FROM stat_counters")
+        loaders[key].close()
+    stage("indexes + analyze", 0, t)
+    overdue = sum(1 for loan in active if loan[3] < format_datetime(now))
+    print(f"done in {time.perf_counter() - started:.1f} s; {overdue:,} of {len(active):,} active loans overdue")
+
+
+if __name__ == "__main__":
+    main()
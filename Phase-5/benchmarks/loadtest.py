@@ -0,0 +1,217 @@
+"""Offline load test across UserService, BookService and LoanService.
+
+Boots all three services in-process (benchmarks/services.py), seeds users and
+books through the bulk endpoints, then runs a weighted mix of issue_book,
+return_book, search_books and get_user_loans from --concurrency workers for
+--duration seconds. Prints throughput and p50/p95/p99 per endpoint and writes
+the numbers, with the git commit they were measured on, to a JSON file.
+
+    python benchmarks/loadtest.py --duration 20 --concurrency 32
+    python benchmarks/loadtest.py --mix issue=40,return=30,search=20,user_loans=10 --output before.json
+    python benchmarks/loadtest.py --compare before.json
+
+SQLite files in a temporary directory are used unless --user-db, --book-db
+and --loan-db point at (empty) PostgreSQL databases.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import boot_services  # noqa: E402
+
+DEFAULT_MIX = "issue=30,return=20,search=30,user_loans=20"
+SEARCH_TERMS = ["history", "science", "garden", "river", "night", "code", "ocean", "stone", "war", "love"]
+TITLE_WORDS = SEARCH_TERMS + ["light", "city", "empire", "winter", "machine", "song", "road", "glass"]
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("issue", "return", "search", "user_loans"):
+            raise SystemExit(f"Unknown operation '{name}' in --mix")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(int(round(fraction * len(ordered))) - 1, 0))]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def seed(services, users: int, books: int, copies: int, rng: random.Random) -> tuple:
+    response = await services.users.post("/bulk", json=[
+        {"name": f"Student {i}", "email": f"student{i}@example.edu"} for i in range(users)
+    ])
+    response.raise_for_status()
+    user_ids = [result["id"] for result in response.json()["results"] if result.get("id")]
+    response = await services.books.post("/bulk", json=[
+        {"title": " ".join(rng.sample(TITLE_WORDS, 3)).title(), "author": f"Author {i % 97}",
+         "isbn": f"978{i:010d}", "copies": copies}
+        for i in range(books)
+    ])
+    response.raise_for_status()
+    export = await services.books.get("/export", params={"format": "ndjson"})
+    book_ids = [json.loads(line)["id"] for line in export.text.splitlines()]
+    return user_ids, book_ids
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, elapsed: float, ok: bool):
+        self.latencies[endpoint].append(elapsed)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "throughput_rps": round(len(ordered) / duration, 1),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {"total_requests": total, "throughput_rps": round(total / duration, 1), "endpoints": endpoints}
+
+
+async def run_load(services, user_ids, book_ids, weights: dict, concurrency: int, duration: float,
+                   rng: random.Random, recorder: Recorder):
+    active_loans = []
+    operations = list(weights)
+    operation_weights = [weights[name] for name in operations]
+    deadline = time.perf_counter() + duration
+
+    async def call(endpoint: str, request, ok_statuses=(200, 201)):
+        started = time.perf_counter()
+        response = await request
+        recorder.record(endpoint, time.perf_counter() - started, response.status_code in ok_statuses)
+        return response
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights=operation_weights)[0]
+            if operation == "return" and not active_loans:
+                operation = "issue"
+            if operation == "issue":
+                # Running out of copies is an expected 400, not an error
+                response = await call("issue_book", services.loans.post(
+                    "/", json={"user_id": rng.choice(user_ids), "book_id": rng.choice(book_ids)}
+                ), ok_statuses=(201, 400))
+                if response.status_code == 201:
+                    active_loans.append(response.json()["id"])
+            elif operation == "return":
+                loan_id = active_loans.pop(rng.randrange(len(active_loans)))
+                await call("return_book", services.loans.post("/returns", json={"loan_id": loan_id}))
+            elif operation == "search":
+                await call("search_books", services.books.get(
+                    "/", params={"search": rng.choice(SEARCH_TERMS), "per_page": 20}
+                ))
+            else:
+                await call("get_user_loans", services.loans.get(f"/user/{rng.choice(user_ids)}"))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nvs {baseline.get('git_commit') or 'baseline'} ({baseline.get('timestamp')})")
+    for endpoint, stats in current["results"]["endpoints"].items():
+        before = baseline["results"]["endpoints"].get(endpoint)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before[key]:
+                changes.append(f"{key} {(stats[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"  {endpoint:<16} {'  '.join(changes)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds of unmeasured load first")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--books", type=int, default=2000)
+    parser.add_argument("--copies", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--user-db")
+    parser.add_argument("--book-db")
+    parser.add_argument("--loan-db")
+    parser.add_argument("--output", help="JSON results path (default benchmarks/results/loadtest-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier JSON results to diff against")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    database_urls = {key: url for key, url in (("users", args.user_db), ("books", args.book_db),
+                                               ("loans", args.loan_db)) if url}
+    async with boot_services(database_urls) as services:
+        user_ids, book_ids = await seed(services, args.users, args.books, args.copies, rng)
+        if args.warmup > 0:
+            await run_load(services, user_ids, book_ids, weights, args.concurrency, args.warmup, rng, Recorder())
+        recorder = Recorder()
+        started = time.perf_counter()
+        await run_load(services, user_ids, book_ids, weights, args.concurrency, args.duration, rng, recorder)
+        results = recorder.report(time.perf_counter() - started)
+
+    print(f"{'endpoint':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, stats in results["endpoints"].items():
+        print(f"{endpoint:<16} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}")
+    print(f"{'total':<16} {results['total_requests']:>9} {'':>7} {results['throughput_rps']:>8}")
+
+    commit = git_commit()
+    document = {
+        "git_commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "databases": {key: url.split("@")[-1] for key, url in database_urls.items()} or "sqlite",
+        "results": results,
+    }
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                              f"loadtest-{commit or 'nogit'}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"\nresults written to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(document, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Book search page: ORM objects + pydantic response_model vs. column tuples + orjson.
+
+Seeds a temporary SQLite database with BookService's models and times one
+search page both ways, query included, the way search_books used to build
+it and the way it builds it now.
+
+    python benchmarks/serialization.py --books 5000 --per-page 100 --iterations 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "BookService"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from app.database import Base, engine, SessionLocal  # noqa: E402
+from app.models.book import Book  # noqa: E402
+from app.responses import ORJSONResponse, rows_to_dicts  # noqa: E402
+from app.routes.books import BOOK_COLUMNS, BOOK_FIELDS  # noqa: E402
+from app.schemas.book import BookResponse, BookSearchResponse  # noqa: E402
+
+
+def seed(count: int):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add_all(Book(title=f"Title {i}", author=f"Author {i % 500}", isbn=f"isbn-{i}", copies=3, available_copies=3)
+                   for i in range(count))
+        db.commit()
+
+
+def to_response(book) -> BookResponse:
+    # pydantic v2 spells from_orm as model_validate(..., from_attributes=True)
+    if hasattr(BookResponse, "model_validate"):
+        return BookResponse.model_validate(book, from_attributes=True)
+    return BookResponse.from_orm(book)
+
+
+def orm_path(db, per_page: int) -> bytes:
+    books = db.execute(select(Book).order_by(Book.title, Book.id).limit(per_page)).scalars().all()
+    response = BookSearchResponse(books=[to_response(book) for book in books], total=None, page=1,
+                                  per_page=per_page)
+    return json.dumps(jsonable_encoder(response)).encode()
+
+
+def fast_path(db, per_page: int) -> bytes:
+    rows = db.execute(select(*BOOK_COLUMNS).order_by(Book.title, Book.id).limit(per_page)).all()
+    return ORJSONResponse({"books": rows_to_dicts(rows, BOOK_FIELDS), "total": None, "page": 1,
+                           "per_page": per_page, "next_cursor": None}).body
+
+
+def measure(fn, db, per_page: int, iterations: int) -> dict:
+    fn(db, per_page)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(db, per_page)
+    elapsed = time.perf_counter() - started
+    return {"path": fn.__name__, "per_page": per_page, "ms_per_page": round(elapsed / iterations * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=5000)
+    parser.add_argument("--per-page", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    seed(args.books)
+    with SessionLocal() as db:
+        for fn in (orm_path, fast_path):
+            print(measure(fn, db, args.per_page, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Boot UserService, BookService and LoanService in one process.
+
+Every service has its own top-level ``app`` package, so each is imported with
+its directory first on sys.path and its ``app.*`` modules are moved aside
+before the next one loads. LoanService's downstream clients are then pointed
+at the other two apps through httpx.ASGITransport: no sockets, no ports.
+
+    async with boot_services() as services:
+        response = await services.loans.get("/stats")
+"""
+import importlib
+import os
+import sys
+import tempfile
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVICES = {"users": "UserService", "books": "BookService", "loans": "LoanService"}
+
+
+def load_service(directory: str, database_url: str, env: dict) -> dict:
+    """Import one service's app.main against database_url and return its app.* modules."""
+    for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+        del sys.modules[name]
+    os.environ.update(env, DATABASE_URL=database_url)
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    sys.path.insert(0, os.path.join(ROOT, directory))
+    try:
+        importlib.import_module("app.main")
+    finally:
+        sys.path.pop(0)
+    return {name: module for name, module in sys.modules.items() if name == "app" or name.startswith("app.")}
+
+
+class Services:
+    def __init__(self, modules: dict, clients: dict):
+        self.modules = modules
+        self.users = clients["users"]
+        self.books = clients["books"]
+        self.loans = clients["loans"]
+
+
+@asynccontextmanager
+async def boot_services(database_urls: dict | None = None, env: dict | None = None):
+    """Yield Services with an httpx client per app, lifespans started.
+
+    database_urls maps "users"/"books"/"loans" to a DATABASE_URL; missing
+    entries get a fresh SQLite file in a temporary directory.
+    """
+    database_urls = dict(database_urls or {})
+    directory = tempfile.mkdtemp(prefix="library-bench-")
+    for key in SERVICES:
+        database_urls.setdefault(key, f"sqlite:///{os.path.join(directory, key)}.db")
+    env = {"TRACE_FILE": "", "USER_SERVICE_URL": "http://users", "BOOK_SERVICE_URL": "http://books", **(env or {})}
+    modules = {key: load_service(service, database_urls[key], env) for key, service in SERVICES.items()}
+    apps = {key: modules[key]["app.main"].app for key in SERVICES}
+
+    async with AsyncExitStack() as stack:
+        for key, app in apps.items():
+            await stack.enter_async_context(app.router.lifespan_context(app))
+        # Swap the lifespan's network clients for in-process transports
+        clients_module = modules["loans"]["app.clients"]
+        for service, key in ((clients_module.user_service, "users"), (clients_module.book_service, "books")):
+            await service.close()
+            await service.start(transport=httpx.ASGITransport(app=apps[key]))
+        prefixes = {"users": "/api/users", "books": "/api/books", "loans": "/api/loans"}
+        clients = {}
+        for key, app in apps.items():
+            clients[key] = await stack.enter_async_context(httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url=f"http://{key}{prefixes[key]}", timeout=60
+            ))
+        yield Services(modules, clients)
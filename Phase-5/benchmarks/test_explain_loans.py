@@ -0,0 +1,27 @@
+"""Query plan regression test for the LoanService hot queries.
+
+    python -m pytest benchmarks/test_explain_loans.py
+"""
+import pytest
+
+import explain_loans
+
+
+@pytest.fixture(scope="module")
+def conn():
+    explain_loans.run_migrations(explain_loans.engine, explain_loans.Base.metadata)
+    with explain_loans.engine.begin() as conn:
+        explain_loans.prepare(conn)
+        yield conn
+
+
+@pytest.mark.parametrize("name,statement,indexes", explain_loans.CHECKS, ids=[c[0] for c in explain_loans.CHECKS])
+def test_plan_uses_index_without_full_scan(conn, name, statement, indexes):
+    plan = explain_loans.explain(conn, statement)
+    assert not explain_loans.check(plan, indexes), f"{name}:\n{plan}"
+
+
+def test_full_scan_is_detected():
+    assert explain_loans.check("SCAN loans", ("ix_loans_status_due_date",))
+    assert explain_loans.check("Seq Scan on loans  (cost=0.00..1.00 rows=1 width=4)", ("loans_pkey",))
+    assert not explain_loans.check("SCAN loans USING INDEX ix_loans_active_user_id", ("ix_loans_active_user_id",))
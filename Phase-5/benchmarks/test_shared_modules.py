@@ -0,0 +1,36 @@
+"""Checks that the modules each service carries a copy of are still identical.
+
+LoanService holds the canonical copy; after editing it, copy it over:
+
+    cp LoanService/app/metrics.py BookService/app/ && cp LoanService/app/metrics.py UserService/app/
+"""
+import hashlib
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CANONICAL = "LoanService"
+SHARED_MODULES = {
+    "metrics.py": ("BookService", "UserService"),
+    "tracing.py": ("BookService", "UserService"),
+    "export.py": ("BookService", "UserService"),
+    "responses.py": ("BookService",),
+    "database.py": ("BookService", "UserService"),
+    "stats.py": ("BookService", "UserService"),
+    "models/stat.py": ("BookService", "UserService"),
+    "migrations.py": ("BookService", "UserService"),
+    "pagination.py": ("BookService",),
+}
+
+
+def digest(service: str, module: str) -> str:
+    with open(os.path.join(ROOT, service, "app", module), "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+@pytest.mark.parametrize("module,copies", SHARED_MODULES.items(), ids=list(SHARED_MODULES))
+def test_copies_match_canonical(module, copies):
+    expected = digest(CANONICAL, module)
+    drifted = [service for service in copies if digest(service, module) != expected]
+    assert not drifted, f"{module} differs from {CANONICAL}/app/{module} in: {', '.join(drifted)}"
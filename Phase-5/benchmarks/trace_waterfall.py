@@ -0,0 +1,78 @@
+"""Print span waterfalls from the JSON-lines files written by app/tracing.py.
+
+Spans from every service are grouped by trace and drawn as an indented tree,
+offset and bar scaled to the trace's first span. Several files (one per
+service) can be merged. The services only write spans when started with
+TRACE_FILE set (e.g. TRACE_FILE=traces.jsonl); a rotated TRACE_FILE.1 can be
+passed as well.
+
+    python benchmarks/trace_waterfall.py LoanService/traces.jsonl BookService/traces.jsonl UserService/traces.jsonl
+    python benchmarks/trace_waterfall.py traces.jsonl --request-id 4bf92f3577b34da6a3ce929d0e0e4736
+    python benchmarks/trace_waterfall.py traces.jsonl --slowest 5
+"""
+import argparse
+import json
+from collections import defaultdict
+
+BAR_WIDTH = 40
+
+
+def load(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span["trace_id"]].append(span)
+    return traces
+
+
+def render(spans):
+    by_id = {span["span_id"]: span for span in spans}
+    children = defaultdict(list)
+    roots = []
+    for span in spans:
+        if span["parent_id"] in by_id:
+            children[span["parent_id"]].append(span)
+        else:
+            roots.append(span)
+    start = min(span["start"] for span in spans)
+    end = max(span["start"] + span["duration_ms"] / 1000 for span in spans)
+    total_ms = max((end - start) * 1000, 0.001)
+    print(f"trace {spans[0]['trace_id']}  request {spans[0]['request_id']}  {total_ms:.1f} ms")
+
+    def draw(span, depth):
+        offset_ms = (span["start"] - start) * 1000
+        left = int(offset_ms / total_ms * BAR_WIDTH)
+        width = max(int(span["duration_ms"] / total_ms * BAR_WIDTH), 1)
+        bar = " " * left + "#" * width
+        label = f"{'  ' * depth}{span['service']}: {span['name']}"
+        error = f"  ! {span['error']}" if span.get("error") else ""
+        print(f"  {label[:60]:<60} {offset_ms:8.1f} {span['duration_ms']:8.1f} ms |{bar:<{BAR_WIDTH}}|{error}")
+        for child in sorted(children[span["span_id"]], key=lambda s: s["start"]):
+            draw(child, depth + 1)
+
+    for root in sorted(roots, key=lambda s: s["start"]):
+        draw(root, 0)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--request-id", help="only the trace with this request id")
+    parser.add_argument("--slowest", type=int, default=0, help="only the N slowest traces")
+    args = parser.parse_args()
+    traces = list(load(args.files).values())
+    if args.request_id:
+        traces = [spans for spans in traces if spans[0]["request_id"] == args.request_id]
+    if args.slowest:
+        traces.sort(key=lambda spans: max(span["duration_ms"] for span in spans), reverse=True)
+        traces = traces[:args.slowest]
+    for spans in traces:
+        render(spans)
+
+
+if __name__ == "__main__":
+    main()